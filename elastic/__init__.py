@@ -1,11 +1,6 @@
-from elasticsearch import Elasticsearch
-from os import environ
+from connections import es_server, get_es_client
 
 __export__ = ['es_server', 'es']
 
-es_server = 'http://localhost:9200/'
-if environ.get('ELASTICSEARCH_SERVER'):
-    es_server = environ['ELASTICSEARCH_SERVER']
-es = Elasticsearch(es_server)
-
+es = get_es_client()
 
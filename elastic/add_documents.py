@@ -1,5 +1,5 @@
 #!/usr/bin/python
-from pyelasticsearch import ElasticSearch
+from connections import get_es
 
 #from tika import tika
 
@@ -127,7 +127,7 @@ def extract_text(doc, url):
     
 def add_document(entries, es_index='memex', es_doc_type='page', es=None):
     if es is None:
-        es = ElasticSearch('http://localhost:9200/')
+        es = get_es()
 
     es.bulk([es.index_op(doc) for doc in entries],
             index = es_index,
@@ -135,7 +135,7 @@ def add_document(entries, es_index='memex', es_doc_type='page', es=None):
 
 def update_document(entries, id_field='url', es_index='memex', es_doc_type='page', es=None):
     if es is None:
-        es = ElasticSearch('http://localhost:9200/')
+        es = get_es()
     
     es.bulk([es.update_op(doc, id=doc[id_field], upsert=True) for doc in entries],
             index=es_index, 
@@ -0,0 +1,49 @@
+from multiprocessing.pool import ThreadPool
+from threading import Lock
+
+import connections
+from search_documents import search, term_search, get_context, range
+from get_documents import get_documents, get_most_recent_documents
+
+__export__ = ['search_async', 'term_search_async', 'get_context_async', 'range_async',
+              'get_documents_async', 'get_most_recent_documents_async']
+
+# Non blocking variants of the search_documents and get_documents APIs. Each
+# call returns immediately an AsyncResult, whose get() method waits for and
+# returns the result of the wrapped call (or raises its exception), so that
+# independent requests to Elasticsearch run concurrently:
+#
+#   pos = term_search_async('tag', ['Relevant'], index)
+#   neg = term_search_async('tag', ['Irrelevant'], index)
+#   pos_urls, neg_urls = pos.get(), neg.get()
+#
+# Calls run on a process wide pool with as many threads as there are pooled
+# connections per host (ELASTICSEARCH_POOL_SIZE).
+
+_pool = None
+_pool_lock = Lock()
+
+def _submit(func, args, kwargs):
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPool(connections.pool_size)
+    return _pool.apply_async(func, args, kwargs)
+
+def search_async(*args, **kwargs):
+    return _submit(search, args, kwargs)
+
+def term_search_async(*args, **kwargs):
+    return _submit(term_search, args, kwargs)
+
+def get_context_async(*args, **kwargs):
+    return _submit(get_context, args, kwargs)
+
+def range_async(*args, **kwargs):
+    return _submit(range, args, kwargs)
+
+def get_documents_async(*args, **kwargs):
+    return _submit(get_documents, args, kwargs)
+
+def get_most_recent_documents_async(*args, **kwargs):
+    return _submit(get_most_recent_documents, args, kwargs)
@@ -0,0 +1,62 @@
+from pyelasticsearch import ElasticSearch
+from elasticsearch import Elasticsearch
+from threading import RLock
+from os import environ
+
+__export__ = ['es_server', 'configure', 'get_es', 'get_es_client']
+
+# Process wide registry of Elasticsearch clients. Clients are created once per
+# host and library (pyelasticsearch and elasticsearch-py) and shared by every
+# caller, each keeping its own pool of keep-alive connections to the host.
+
+es_server = environ.get('ELASTICSEARCH_SERVER', 'http://localhost:9200/')
+
+# Maximum number of kept alive connections per host, and request timeout in
+# seconds. pyelasticsearch clients only take the timeout, and keep the default
+# pool of their transport.
+pool_size = int(environ.get('ELASTICSEARCH_POOL_SIZE', 10))
+timeout = int(environ.get('ELASTICSEARCH_TIMEOUT', 60))
+
+_clients = {}
+_lock = RLock()
+
+def configure(server=None, opt_pool_size=None, opt_timeout=None):
+    global es_server, pool_size, timeout
+
+    with _lock:
+        if not server is None:
+            es_server = server
+        if not opt_pool_size is None:
+            pool_size = int(opt_pool_size)
+        if not opt_timeout is None:
+            timeout = int(opt_timeout)
+        # Clients created with the previous settings are dropped.
+        _clients.clear()
+
+def _get_client(lib, host, create):
+    if host is None:
+        host = es_server
+    key = (lib, host.rstrip('/'))
+
+    with _lock:
+        client = _clients.get(key)
+        if client is None:
+            client = create(host)
+            _clients[key] = client
+    return client
+
+def _create_es(host):
+    return ElasticSearch(host, timeout=timeout)
+
+def _create_es_client(host):
+    return Elasticsearch(host, maxsize=pool_size, timeout=timeout, retry_on_timeout=True)
+
+# Returns the shared pyelasticsearch client for host (ELASTICSEARCH_SERVER by
+# default).
+def get_es(host=None):
+    return _get_client('pyelasticsearch', host, _create_es)
+
+# Returns the shared elasticsearch-py client for host (ELASTICSEARCH_SERVER by
+# default).
+def get_es_client(host=None):
+    return _get_client('elasticsearch', host, _create_es_client)
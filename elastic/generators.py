@@ -1,15 +1,83 @@
 #!/usr/bin/env python
 
-from elasticsearch import Elasticsearch
-from elasticsearch.helpers import scan
+from elasticsearch.exceptions import TransportError
+from connections import get_es_client
+from search_documents import search_query, term_search_query, context_query, range_query
 import math
 
-__export__ = ['ids_generator', 'termvectors_generator' ]
+__export__ = ['ids_generator', 'urls_generator', 'search_generator', 'term_search_generator',
+              'context_generator', 'range_generator', 'termvectors_generator' ]
 
-def ids_generator(es, index, doc_type):
-    for res in scan(es, index=index, doc_type=doc_type, query={ "query": { "match_all": {} } }, fields=[]):
+# All generators below scroll through every matching document, page_size hits
+# per shard at a time, instead of returning a capped list of hits.
+
+# Yields the hits of query, as elasticsearch.helpers.scan, but clears the
+# scroll once the generator is exhausted or closed, e.g. by a caller only
+# reading the first hits with islice, instead of leaving it open until it
+# times out.
+def _scan(es, query, index, doc_type, size, scroll='5m'):
+    res = es.search(index=index, doc_type=doc_type, body=query, search_type='scan', scroll=scroll, size=size)
+    scroll_id = res.get('_scroll_id')
+    try:
+        while scroll_id is not None:
+            res = es.scroll(scroll_id=scroll_id, scroll=scroll)
+            scroll_id = res.get('_scroll_id')
+            if len(res['hits']['hits']) == 0:
+                break
+            for hit in res['hits']['hits']:
+                yield hit
+    finally:
+        # The scroll of an exhausted scan may already be freed.
+        if scroll_id is not None:
+            try:
+                es.clear_scroll(scroll_id=scroll_id)
+            except TransportError:
+                pass
+
+def ids_generator(es, index, doc_type, page_size=500):
+    query = {
+        "query": {
+            "match_all": {}
+        },
+        "fields": []
+    }
+    for res in _scan(es, query, index, doc_type, page_size):
         yield res['_id']
 
+def urls_generator(es, index='memex', doc_type='page', page_size=500):
+    query = {
+        "query": {
+            "match_all": {}
+        },
+        "fields": ['url']
+    }
+    # Documents without url are skipped.
+    for res in _scan(es, query, index, doc_type, page_size):
+        if not res.get('fields') is None and not res['fields'].get('url') is None:
+            yield res['fields']['url'][0]
+
+def search_generator(es, field, queryStr, index='memex', doc_type='page', page_size=500):
+    if len(queryStr) > 0:
+        for res in _scan(es, search_query(field, queryStr), index, doc_type, page_size):
+            yield res['_id']
+
+def term_search_generator(es, field, queryStr, index='memex', doc_type='page', page_size=500):
+    if len(queryStr) > 0:
+        for res in _scan(es, term_search_query(field, queryStr), index, doc_type, page_size):
+            yield res['_id']
+
+def context_generator(es, terms, index='memex', doc_type='page', page_size=500):
+    if len(terms) > 0:
+        for res in _scan(es, context_query(terms), index, doc_type, page_size):
+            yield res['highlight']['text'][0]
+
+def range_generator(es, field, from_val, to_val, ret_fields=[], epoch=None, index='memex', doc_type='page', page_size=500):
+    query = range_query(field, from_val, to_val, ret_fields, epoch)
+    # Documents holding none of ret_fields are skipped.
+    for res in _scan(es, query, index, doc_type, page_size):
+        if not res.get('fields') is None:
+            yield res['fields']
+
 
 def tfidf(tf, df, n_docs):
     idf = math.log(n_docs / float(df))
@@ -35,6 +103,7 @@ def termvectors_generator(es, index, doc_type, ids_generator, fields=None, size=
             ids = []
 
 if __name__ == "__main__":
+    es = get_es_client()
     all_hits = []
     #for hits in search_generator(es, index='memex', doc_type='page'):
     for id in ids_generator(es, index='memex', doc_type='page'):
@@ -1,10 +1,10 @@
-from pyelasticsearch import ElasticSearch
+from connections import get_es
 from pprint import pprint
 from datetime import datetime
 
 def get_available_domains(es=None):
     if es is None:
-        es = ElasticSearch("http://localhost:9200")
+        es = get_es()
         
     query = {
         "query": {
@@ -1,40 +1,85 @@
 #!/usr/bin/python
-from pyelasticsearch import ElasticSearch
+from connections import get_es
+from search_documents import BLOB_FIELDS
+from datetime import datetime
 
-def get_documents(terms, term_field, fields=["text"], es_index='memex', es_doc_type='page', es=None):
+def get_documents(terms, term_field, fields=["text"], es_index='memex', es_doc_type='page', es=None, batch_size=500):
     if es is None:
-        es = ElasticSearch('http://localhost:9200/')
+        es = get_es()
+
+    if isinstance(terms, basestring):
+        terms = [terms]
+
+    results = {}
+
+    # Resolves the keys batch_size at a time: one multi get when the key is the
+    # document id, one terms filter query otherwise.
+    for i in range(0, len(terms), batch_size):
+        batch = terms[i:i+batch_size]
+
+        if term_field == '_id':
+            res = es.multi_get(batch, index=es_index, doc_type=es_doc_type, fields=fields)
+            for doc in res['docs']:
+                if doc.get('found') and not doc.get('fields') is None:
+                    results[doc['_id']] = get_record(doc['fields'], fields)
+            continue
+
+        query = {
+            "query": {
+                "filtered": {
+                    "filter": {
+                        "terms": {
+                            term_field: batch
+                        }
+                    }
+                }
+            },
+            "fields": list(set(fields + [term_field]))
+        }
 
-    if len(terms) > 0:
-        results = {}
+        res = es.search(query,
+                        index=es_index,
+                        doc_type=es_doc_type,
+                        size=len(batch))
 
-        for term in terms:
-            query = {
-                "query": {
-                    "term": {
-                        term_field: term
-                    }
-                },
-                "fields": fields
-            }
-        
-            res = es.search(query, 
+        # Several documents can share the same key, fetch them all so that no
+        # key of the batch is left out.
+        if res['hits']['total'] > len(res['hits']['hits']):
+            res = es.search(query,
                             index=es_index,
-                            doc_type=es_doc_type)
-
-            if res['hits']['hits']:
-                hits = res['hits']['hits'][0]
-
-                if not hits.get('fields') is None:
-                    hits = hits['fields']
-                    record = {}
-                    for field in fields:
-                        if(not hits.get(field) is None):
-                            record[field] = hits[field][0]
-                    results[term] = record           
-            
+                            doc_type=es_doc_type,
+                            size=res['hits']['total'])
+
+        # Results are keyed by the requested keys. A hit whose value is not
+        # one of them, e.g. a token of an analyzed field, can not tell which
+        # key it matched, so the keys left are then looked up one at a time.
+        keys = set(batch)
+        unmatched = False
+        for hit in res['hits']['hits']:
+            if not hit.get('fields') is None and not hit['fields'].get(term_field) is None:
+                term = hit['fields'][term_field][0]
+                if not term in keys:
+                    unmatched = True
+                elif results.get(term) is None:
+                    results[term] = get_record(hit['fields'], fields)
+
+        if unmatched:
+            for term in batch:
+                if results.get(term) is None:
+                    query['query']['filtered']['filter']['terms'][term_field] = [term]
+                    res = es.search(query, index=es_index, doc_type=es_doc_type, size=1)
+                    for hit in res['hits']['hits']:
+                        if not hit.get('fields') is None:
+                            results[term] = get_record(hit['fields'], fields)
+
     return results
 
+def get_record(hit_fields, fields):
+    record = {}
+    for field in fields:
+        if(not hit_fields.get(field) is None):
+            record[field] = hit_fields[field][0]
+    return record
             
 # Returns most recent documents in the format:
 # [
@@ -42,9 +87,12 @@ def get_documents(terms, term_field, fields=["text"], es_index='memex', es_doc_t
 #   ["url", "x", "y", "tag", "retrieved"],
 #   ...
 # ]
-def get_most_recent_documents(opt_maxNumberOfPages = 1000, fields = [], opt_filter = None, es_index = 'memex', es_doc_type = 'page', es = None):
+# If opt_retrievedFrom (epoch in seconds) is given, only documents retrieved
+# from then on are returned.
+def get_most_recent_documents(opt_maxNumberOfPages = 1000, fields = [], opt_filter = None, es_index = 'memex', es_doc_type = 'page', es = None,
+                              opt_retrievedFrom = None):
     if es is None:
-        es = ElasticSearch('http://localhost:9200')
+        es = get_es()
 
     query = { 
         "size": opt_maxNumberOfPages,
@@ -69,21 +117,39 @@ def get_most_recent_documents(opt_maxNumberOfPages = 1000, fields = [], opt_filt
             }
         }
 
+    if not opt_retrievedFrom is None:
+        query["query"] = {
+            "filtered": {
+                "query": query["query"],
+                "filter": {
+                    "range": {
+                        "retrieved": {
+                            "gte": datetime.utcfromtimestamp(float(opt_retrievedFrom)).strftime('%Y-%m-%dT%H:%M:%S.%f')[:-3]
+                        }
+                    }
+                }
+            }
+        }
+
     if len(fields) > 0:
         query["fields"] = fields
+    else:
+        query["_source"] = {
+            "exclude": BLOB_FIELDS
+        }
 
     res = es.search(query, index = es_index, doc_type = es_doc_type)
     hits = res['hits']['hits']
 
     results = []
     for hit in hits:
-        results.append(hit['fields'])
+        results.append(hit['fields'] if len(fields) > 0 else hit['_source'])
 
     return results
 
 def get_all_ids(es_index = 'memex', es_doc_type = 'page', es = None):
     if es is None:
-        es = ElasticSearch('http://localhost:9200')
+        es = get_es()
 
     query = {
         "query": {
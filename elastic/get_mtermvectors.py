@@ -1,11 +1,15 @@
 #!/usr/bin/env python
-from sklearn.feature_extraction import DictVectorizer
+from scipy.sparse import csr_matrix
+from array import array
+import numpy as np
 import nltk
 import sys
 import pprint
 import math
 from os import environ
-from elasticsearch import Elasticsearch
+from multiprocessing.pool import ThreadPool
+from connections import get_es_client
+from termvectors_cache import get_cache
 
 ENGLISH_STOPWORDS = set(nltk.corpus.stopwords.words('english'))
 
@@ -38,56 +42,223 @@ def terms_from_es_json(doc, rm_stopwords=True, pos_tags=[]):
 
     return terms
 
-def getTermStatistics(all_hits, es_index='memex', es_doc_type='page', es=None):
+# Terms held by fewer than min_df documents, or by more than a ratio max_df of
+# the documents, are left out of the results, as are all terms but the
+# max_features most frequent ones (if not None).
+def getTermStatistics(all_hits, es_index='memex', es_doc_type='page', es=None, batch_size=100, workers=4, use_cache=True,
+                      min_df=1, max_df=1.0, max_features=None):
     if es is None:
-        es = Elasticsearch('http://localhost:9200/')
+        es = get_es_client()
+
+    cache = get_cache() if use_cache else None
 
-    stats = []
     docs = []
 
     ttf = {}
-    for i in range(0, len(all_hits), 100):
-        hits = all_hits[i:i+100]
-
-        term_res = es.mtermvectors(index=es_index,
-                                   doc_type=es_doc_type,
-                                   term_statistics=True, 
-                                   fields=['text'], 
-                                   ids=hits)
-
-        #pprint.pprint(term_res['docs'])
-
-        for doc in term_res['docs']:
-            #pprint.pprint(doc)
-            if doc.get('term_vectors'):
-                if 'text' in doc['term_vectors']:
-                    docs.append(doc['_id'])
-                    res = terms_from_es_json(doc)
-                    stats.append(res)
-                    for k in res.keys():
-                        ttf[k] = res[k]['ttf']
-            #else:
-             #   pprint.pprint(doc)
-        #pprint.pprint(tfidfs)
-    
-    tfidfs = []
-    for stat in stats:
-        tfidf={}
-        for k in stat.keys():
-            tfidf[k] =stat[k]['tfidf']
-        tfidfs.append(tfidf)
-
-    tfs = []
-    for stat in stats:
-        tf={}
-        for k in stat.keys():
-            tf[k] =stat[k]['tf']
-        tfs.append(tf)
-    
-    v_tfidf = DictVectorizer()
-    v_tf = DictVectorizer()
-    
-    result = [v_tfidf.fit_transform(tfidfs), v_tf.fit_transform(tfs), ttf, v_tfidf.get_feature_names()]
+
+    # Returns the [id, terms] pairs of the documents in hits that have term
+    # vectors. Only term statistics are needed: positions, offsets and payloads
+    # are not requested.
+    def fetch(hits):
+        cached = {}
+        missing = hits
+        if cache is not None:
+            # Document versions tell whether the cached term vectors are still
+            # valid. They are only looked up for the documents in the cache.
+            # Documents cached without term vectors have a None value.
+            candidates = cache.contains(es_index, hits)
+            if len(candidates) > 0:
+                ver_res = es.mget(index=es_index,
+                                  doc_type=es_doc_type,
+                                  body={'ids': [hit for hit in hits if hit in candidates]},
+                                  _source=False)
+                stamps = {doc['_id']: doc['_version'] for doc in ver_res['docs'] if doc.get('found')}
+                cached = cache.get(es_index, stamps)
+            missing = [hit for hit in hits if hit not in cached]
+
+        fetched = {}
+        if len(missing) > 0:
+            term_res = es.mtermvectors(index=es_index,
+                                       doc_type=es_doc_type,
+                                       term_statistics=True,
+                                       field_statistics=True,
+                                       positions=False,
+                                       offsets=False,
+                                       payloads=False,
+                                       fields=['text'], 
+                                       ids=missing)
+
+            for doc in term_res['docs']:
+                terms = None
+                if doc.get('term_vectors'):
+                    if 'text' in doc['term_vectors']:
+                        terms = terms_from_es_json(doc)
+                        fetched[doc['_id']] = terms
+                if cache is not None and doc.get('found') and not doc.get('_version') is None:
+                    cache.put(es_index, doc['_id'], doc['_version'], terms)
+
+        results = []
+        for hit in hits:
+            terms = cached.get(hit)
+            if terms is None:
+                terms = fetched.get(hit)
+            if terms is not None:
+                results.append([hit, terms])
+        return results
+
+    batches = [all_hits[i:i+batch_size] for i in range(0, len(all_hits), batch_size)]
+
+    # Up to workers batches are fetched concurrently, results are still
+    # processed in the order of all_hits.
+    pool = None
+    if workers > 1 and len(batches) > 1:
+        pool = ThreadPool(min(workers, len(batches)))
+        results = pool.imap(fetch, batches)
+    else:
+        results = (fetch(hits) for hits in batches)
+
+    # Term vectors are streamed into the CSR arrays of the tf-idf and tf
+    # matrices, which have the same vocabulary, indices and indptr.
+    vocabulary = {}
+    indptr = array('i', [0])
+    indices = array('i')
+    tfidf_data = array('d')
+    tf_data = array('d')
+
+    try:
+        for batch_results in results:
+            for [doc_id, res] in batch_results:
+                docs.append(doc_id)
+                for k, v in res.iteritems():
+                    indices.append(vocabulary.setdefault(k, len(vocabulary)))
+                    tfidf_data.append(v['tfidf'])
+                    tf_data.append(v['tf'])
+                    ttf[k] = v['ttf']
+                indptr.append(len(indices))
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    [data_tfidf, data_tf, corpus] = build_term_matrices(vocabulary, indptr, indices, tfidf_data, tf_data)
+
+    df = np.bincount(data_tf.indices, minlength=len(corpus))
+    tf_sum = np.bincount(data_tf.indices, weights=data_tf.data, minlength=len(corpus))
+    columns = prune_vocabulary(df, len(docs), min_df, max_df, max_features, tf_sum)
+    if len(columns) < len(corpus):
+        data_tfidf = data_tfidf[:, columns]
+        data_tf = data_tf[:, columns]
+        corpus = [corpus[i] for i in columns]
+        ttf = {term: ttf[term] for term in corpus}
+
+    # docs are the ids of the matrices rows: documents without term vectors
+    # are left out.
+    result = [data_tfidf, data_tf, ttf, corpus, docs]
 
     return result
 
+# Returns the term frequencies of the documents ids with the index wide
+# statistics of their terms, as used to score documents of the whole index
+# against them (see rank.indexResults):
+#   [data_tf, corpus, df, ttf, n_doc, docs]
+# where data_tf is the tf CSR matrix of docs (the ids with term vectors) over
+# the terms of corpus, df and ttf are arrays of the document and total
+# frequencies of these terms in the index, and n_doc is the number of
+# documents of the index with term vectors.
+def getIndexTermStatistics(ids, es_index='memex', es_doc_type='page', es=None):
+    if es is None:
+        es = get_es_client()
+
+    docs = []
+    n_doc = 0
+    stats = {}
+    vocabulary = {}
+    indptr = array('i', [0])
+    indices = array('i')
+    tf_data = array('d')
+
+    if len(ids) > 0:
+        res = es.mtermvectors(index=es_index,
+                              doc_type=es_doc_type,
+                              term_statistics=True,
+                              field_statistics=True,
+                              positions=False,
+                              offsets=False,
+                              payloads=False,
+                              fields=['text'],
+                              ids=ids)
+
+        for doc in res['docs']:
+            if not doc.get('term_vectors') or not 'text' in doc['term_vectors']:
+                continue
+            text = doc['term_vectors']['text']
+            n_doc = max(n_doc, text['field_statistics']['doc_count'])
+            docs.append(doc['_id'])
+            for k, v in text['terms'].iteritems():
+                if k in ENGLISH_STOPWORDS or len(k) <= 2:
+                    continue
+                indices.append(vocabulary.setdefault(k, len(vocabulary)))
+                tf_data.append(v['term_freq'])
+                stats[k] = [v['doc_freq'], v['ttf']]
+            indptr.append(len(indices))
+
+    [data_tf, _, corpus] = build_term_matrices(vocabulary, indptr, indices, tf_data, tf_data)
+
+    df = np.array([stats[term][0] for term in corpus], dtype=np.float64)
+    ttf = np.array([stats[term][1] for term in corpus], dtype=np.float64)
+
+    return [data_tf, corpus, df, ttf, n_doc, docs]
+
+# Returns the (sorted) columns of the terms kept among terms of document
+# frequencies df in n_docs documents: those held by at least min_df documents
+# and at most a ratio max_df of them, and among those the max_features ones
+# with the highest total frequencies tf_sum (or document frequencies).
+def prune_vocabulary(df, n_docs, min_df=1, max_df=1.0, max_features=None, tf_sum=None):
+    df = np.asarray(df)
+    keep = df >= min_df
+    if max_df < 1.0:
+        keep &= df <= max_df * n_docs
+    columns = np.where(keep)[0]
+
+    if max_features is not None and len(columns) > max_features:
+        frequency = np.asarray(tf_sum if tf_sum is not None else df)[columns]
+        # Ties are broken by column, so that results do not depend on the sort
+        top = np.lexsort((columns, -frequency))[:max_features]
+        columns = np.sort(columns[top])
+
+    return columns
+
+# Builds the tf-idf and tf CSR matrices from the arrays filled in
+# getTermStatistics. Columns are sorted by term, as DictVectorizer does. Each
+# matrix has its own indices and indptr arrays, so that in place operations on
+# one (sort_indices, eliminate_zeros, ...) leave the other intact.
+def build_term_matrices(vocabulary, indptr, indices, tfidf_data, tf_data):
+    corpus = sorted(vocabulary.keys())
+
+    n_docs = len(indptr) - 1
+    indptr = np.frombuffer(indptr, dtype=np.int32)
+    if len(indices) > 0:
+        indices = np.frombuffer(indices, dtype=np.int32)
+        tfidf_data = np.frombuffer(tfidf_data, dtype=np.float64)
+        tf_data = np.frombuffer(tf_data, dtype=np.float64)
+    else:
+        indices = np.empty(0, dtype=np.int32)
+        tfidf_data = np.empty(0, dtype=np.float64)
+        tf_data = np.empty(0, dtype=np.float64)
+
+    # Maps the columns to sorted term order and sorts the indices of each row.
+    column = np.empty(len(vocabulary), dtype=np.int32)
+    for i, term in enumerate(corpus):
+        column[vocabulary[term]] = i
+    indices = column[indices]
+
+    rows = np.repeat(np.arange(n_docs, dtype=np.int32), np.diff(indptr))
+    order = np.lexsort((indices, rows))
+    indices = indices[order]
+    indptr = indptr.copy()
+
+    shape = (n_docs, len(corpus))
+    data_tfidf = csr_matrix((tfidf_data[order], indices, indptr), shape=shape, copy=False)
+    data_tf = csr_matrix((tf_data[order], indices.copy(), indptr.copy()), shape=shape, copy=False)
+
+    return [data_tfidf, data_tf, corpus]
@@ -1,12 +1,9 @@
 #!/usr/bin/python
-from elasticsearch import ElasticSearch
+from connections import get_es
 import sys
 from os import environ
 
-es_server = 'http://localhost:9200/'
-if environ.get('ELASTICSEARCH_SERVER'):
-    es_server = environ['ELASTICSEARCH_SERVER']
-es = ElasticSearch(es_server)
+es = get_es()
 
 query = {
     "query": {
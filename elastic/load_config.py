@@ -1,17 +1,13 @@
 import json
 import sys
-from pyelasticsearch import ElasticSearch
+from connections import get_es
 from datetime import datetime
 from pprint import pprint
 from add_documents import add_document
 
 
 def load_config(config_file, es_index='config', es_doc_type='domains', es_host=None):
-    es = None
-    if es_host is None:
-        es = ElasticSearch('http://localhost:9200/')
-    else:
-        es = ElasticSearch(es_host)
+    es = get_es(es_host)
 
     with open(config_file) as data_file:
         data = json.load(data_file)
@@ -0,0 +1,56 @@
+from elasticsearch.exceptions import TransportError
+from connections import get_es_client
+
+__export__ = ['MultiSearch', 'hits_ids', 'hits_fields']
+
+# Batches independent searches into a single _msearch request:
+#
+#   msearch = MultiSearch()
+#   msearch.add(term_search_query('tag', ['Relevant']), index, 'page', 500, hits_ids)
+#   msearch.add(term_search_query('tag', ['Irrelevant']), index, 'page', 500, hits_ids)
+#   [pos_urls, neg_urls] = msearch.execute()
+#
+# execute() returns the responses in the order the searches were added, each
+# one passed through the parse function given to add(), if any.
+class MultiSearch:
+    def __init__(self, es=None):
+        if es is None:
+            es = get_es_client()
+        self.es = es
+        self.searches = []
+
+    # Adds a search and returns its position in the list returned by execute().
+    def add(self, query, es_index='memex', es_doc_type='page', size=None, parse=None):
+        body = dict(query)
+        if not size is None:
+            body['size'] = size
+        self.searches.append([{'index': es_index, 'type': es_doc_type}, body, parse])
+        return len(self.searches) - 1
+
+    def execute(self):
+        searches = self.searches
+        self.searches = []
+        if len(searches) == 0:
+            return []
+
+        body = []
+        for [header, query, _] in searches:
+            body.append(header)
+            body.append(query)
+
+        res = self.es.msearch(body=body)
+
+        results = []
+        for [_, _, parse], response in zip(searches, res['responses']):
+            if 'error' in response:
+                raise TransportError(500, response['error'])
+            results.append(response if parse is None else parse(response))
+        return results
+
+# Returns the ids of the hits of a search response.
+def hits_ids(res):
+    return [hit['_id'] for hit in res['hits']['hits']]
+
+# Returns the fields of the hits of a search response.
+def hits_fields(res):
+    return [hit['fields'] for hit in res['hits']['hits']]
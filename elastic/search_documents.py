@@ -1,26 +1,24 @@
 #!/usr/bin/python
-from pyelasticsearch import ElasticSearch
+from connections import get_es
 import sys
 import urllib2
 import base64
 from os import environ
 from pprint import pprint
 from datetime import datetime
+
+# Large fields of page documents (base64 encoded). They are kept in _source,
+# which partial updates (update_document) rebuild documents from, and are
+# excluded from it by queries which do not need them. They are fetched by url
+# when needed, e.g. with get_image.
+BLOB_FIELDS = ['html', 'thumbnail']
         
 def search(field, queryStr, es_index='memex', es_doc_type='page', es=None):
     if es is None:
-        es = ElasticSearch("http://localhost:9200")
+        es = get_es()
 
     if len(queryStr) > 0:
-        query = {
-            "query": {
-                "query_string": {
-                    "fields" : [field],
-                    "query": ' and  '.join(queryStr[0:]),
-                }
-            },
-            "fields": [field]
-        }
+        query = search_query(field, queryStr)
         print query
         res = es.search(query, index=es_index, doc_type=es_doc_type, size=500)
         hits = res['hits']
@@ -29,22 +27,23 @@ def search(field, queryStr, es_index='memex', es_doc_type='page', es=None):
             urls.append(hit['_id'])
         return urls
 
+def search_query(field, queryStr):
+    return {
+        "query": {
+            "query_string": {
+                "fields" : [field],
+                "query": ' and  '.join(queryStr[0:]),
+            }
+        },
+        "fields": [field]
+    }
+
 def term_search(field, queryStr, es_index='memex', es_doc_type='page', es=None):
     if es is None:
-        es = ElasticSearch("http://localhost:9200")
+        es = get_es()
 
     if len(queryStr) > 0:
-        query = {
-            "query" : {
-                "match": {
-                    field: {
-                        "query": ' '.join(queryStr),
-                        "minimum_should_match":"100%"
-                    }
-                }
-            },
-            "fields": ["url"]
-        }
+        query = term_search_query(field, queryStr)
         print query
         res = es.search(query, index=es_index, doc_type=es_doc_type, size=500)
 
@@ -54,9 +53,22 @@ def term_search(field, queryStr, es_index='memex', es_doc_type='page', es=None):
             urls.append(hit['_id'])
         return urls
 
+def term_search_query(field, queryStr):
+    return {
+        "query" : {
+            "match": {
+                field: {
+                    "query": ' '.join(queryStr),
+                    "minimum_should_match":"100%"
+                }
+            }
+        },
+        "fields": ["url"]
+    }
+
 def get_image(url, es_index='memex', es_doc_type='page', es=None):
     if es is None:
-        es = ElasticSearch("http://localhost:9200")
+        es = get_es()
 
     if url:
         query = {
@@ -83,26 +95,10 @@ def get_image(url, es_index='memex', es_doc_type='page', es=None):
 
 def get_context(terms, es_index='memex', es_doc_type='page', es=None):
     if es is None:
-        es = ElasticSearch("http://localhost:9200")
+        es = get_es()
 
     if len(terms) > 0:
-        query = {
-            "query": { 
-                "match": {
-                    "text": {
-                        "query": ' and  '.join(terms[0:]),
-                        "operator" : "and"
-                    }
-                }
-             },
-            "highlight" : {
-                "fields" : {
-                    "text": {
-                        "fragment_size" : 100, "number_of_fragments" : 1
-                    }
-                }
-            }
-        }
+        query = context_query(terms)
         print query
         res = es.search(query, index=es_index, doc_type=es_doc_type, size=500)
         hits = res['hits']
@@ -112,16 +108,48 @@ def get_context(terms, es_index='memex', es_doc_type='page', es=None):
             highlights.append(hit['highlight']['text'][0])
         return highlights
 
+def context_query(terms):
+    return {
+        "_source": False,
+        "query": { 
+            "match": {
+                "text": {
+                    "query": ' and  '.join(terms[0:]),
+                    "operator" : "and"
+                }
+            }
+         },
+        "highlight" : {
+            "fields" : {
+                "text": {
+                    "fragment_size" : 100, "number_of_fragments" : 1
+                }
+            }
+        }
+    }
+
 def range(field, from_val, to_val, ret_fields=[], epoch=None, es_index='memex', es_doc_type='page', es=None):
     if es is None:
-        es = ElasticSearch("http://localhost:9200")
+        es = get_es()
 
+    query = range_query(field, from_val, to_val, ret_fields, epoch)
+
+    res = es.search(query, index=es_index, doc_type=es_doc_type, size=500)
+    hits = res['hits']['hits']
+
+    results=[]
+    for hit in hits:
+        results.append(hit['fields'])
+
+    return results
+
+def range_query(field, from_val, to_val, ret_fields=[], epoch=None):
     if not (epoch is None):
         if epoch:
             from_val = datetime.utcfromtimestamp(long(from_val)).strftime('%Y-%m-%dT%H:%M:%S')
             to_val = datetime.utcfromtimestamp(long(to_val)).strftime('%Y-%m-%dT%H:%M:%S')
             
-    query = { 
+    return { 
         "query" : { 
             "range" : { 
                 field : {
@@ -133,14 +161,159 @@ def range(field, from_val, to_val, ret_fields=[], epoch=None, es_index='memex',
         "fields": ret_fields
     }
 
-    res = es.search(query, index=es_index, doc_type=es_doc_type, size=500)
+# Searches the documents holding any of the terms of weights (a dictionary
+# term: weight) in field, scored by the sum of the weights of the terms they
+# hold. Documents exclude_ids are left out. Returns the ids and scores of the
+# hits from offset to offset + size:
+#   [ids, scores]
+def weighted_terms_search(field, weights, exclude_ids=[], size=100, offset=0, es_index='memex', es_doc_type='page', es=None):
+    if es is None:
+        es = get_es()
+
+    if len(weights) == 0:
+        return [[], []]
+
+    query = weighted_terms_query(field, weights, exclude_ids)
+    query['from'] = offset
+
+    res = es.search(query, index=es_index, doc_type=es_doc_type, size=size)
     hits = res['hits']['hits']
 
-    results=[]
-    for hit in hits:
-        results.append(hit['fields'])
+    return [[hit['_id'] for hit in hits], [hit['_score'] for hit in hits]]
 
-    return results
+def weighted_terms_query(field, weights, exclude_ids=[]):
+    terms_filter = {
+        "bool": {
+            "must": [{"terms": {field: weights.keys()}}],
+            "must_not": [{"ids": {"values": exclude_ids}}] if len(exclude_ids) > 0 else []
+        }
+    }
+
+    return {
+        "query": {
+            "function_score": {
+                "query": {
+                    "filtered": {
+                        "filter": terms_filter
+                    }
+                },
+                "functions": [{"filter": {"term": {field: term}}, "weight": weight}
+                              for term, weight in weights.iteritems()],
+                "score_mode": "sum",
+                "boost_mode": "replace"
+            }
+        },
+        "fields": []
+    }
+
+# Returns the ids of up to size documents without a value for field, most
+# recently retrieved first.
+def missing_search(field, size=500, es_index='memex', es_doc_type='page', es=None):
+    if es is None:
+        es = get_es()
+
+    query = missing_query(field)
+
+    res = es.search(query, index=es_index, doc_type=es_doc_type, size=size)
+    hits = res['hits']['hits']
+
+    return [hit['_id'] for hit in hits]
+
+def missing_query(field):
+    return {
+        "query": {
+            "filtered": {
+                "filter": {
+                    "missing": {
+                        "field": field
+                    }
+                }
+            }
+        },
+        "sort": [
+            {
+                "retrieved": {
+                    "order": "desc"
+                }
+            }
+        ],
+        "fields": []
+    }
+
+# Lucene regular expression operators, escaped in tag_filter.
+REGEXP_OPERATORS = '.?+*|{}[]()"\\#@&<>~'
+
+# Returns a filter matching the documents holding tag exactly. Tags are stored
+# joined with ';' in the tag field, which is analyzed, so the whole value is
+# matched on its not_analyzed tag.raw sub-field (see mapping.json).
+def tag_filter(tag):
+    escaped = ''.join('\\' + c if c in REGEXP_OPERATORS else c for c in tag)
+    return {"regexp": {"tag.raw": "(.*;)?" + escaped + "(;.*)?"}}
+
+# Counts the documents with field between from_val and to_val per tag, with a
+# single aggregation request. A document falls in the bucket of the first tag
+# of tags it holds, documents holding none of them (or no tag at all) are
+# counted as 'Neutral'. Returns dictionary in the format:
+# {
+#   tag1: numPages,
+#   tag2: numPages,
+#   'Neutral': numPages
+# }
+def range_tags_summary(field, from_val, to_val, tags=['Relevant', 'Irrelevant'], epoch=None, opt_filter=None, es_index='memex', es_doc_type='page', es=None):
+    if es is None:
+        es = get_es()
+
+    range_filter = range_query(field, from_val, to_val, [], epoch)['query']
+
+    filters = [range_filter]
+    if not opt_filter is None:
+        filters.append({
+            "query": {
+                "query_string": {
+                    "fields" : ['text'],
+                    "query": ' and  '.join(opt_filter.split(' ')),
+                }
+            }
+        })
+
+    buckets = {}
+    previous = []
+    for tag in tags:
+        buckets[tag] = {
+            "bool": {
+                "must": [tag_filter(tag)],
+                "must_not": [tag_filter(prev) for prev in previous]
+            }
+        }
+        previous.append(tag)
+    buckets['Neutral'] = {
+        "bool": {
+            "must_not": [tag_filter(tag) for tag in tags]
+        }
+    } if len(tags) > 0 else {"match_all": {}}
+
+    query = {
+        "size": 0,
+        "query": {
+            "filtered": {
+                "filter": {
+                    "and": filters
+                }
+            }
+        },
+        "aggs": {
+            "tags": {
+                "filters": {
+                    "filters": buckets
+                }
+            }
+        }
+    }
+
+    res = es.search(query, index=es_index, doc_type=es_doc_type)
+
+    counts = res['aggregations']['tags']['buckets']
+    return {tag: counts[tag]['doc_count'] for tag in buckets.keys()}
 
 if __name__ == "__main__":
     print sys.argv[1:]
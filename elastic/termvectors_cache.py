@@ -0,0 +1,156 @@
+import atexit
+import cPickle
+import fcntl
+import shelve
+from collections import OrderedDict
+from contextlib import contextmanager
+from os import environ, makedirs
+from os.path import exists, join
+from tempfile import gettempdir
+from threading import RLock
+
+__export__ = ['TermVectorsCache', 'get_cache']
+
+# Cache of the term vectors of documents, keyed by (index, _id) and validated
+# by a stamp, the document _version: a document indexed again misses the
+# cache. The tf-idf values of cached term vectors keep the index statistics of
+# when they were fetched, documents added to the index since do not invalidate
+# them.
+#
+# Recently used entries are kept in memory up to max_bytes, least recently used
+# ones are spilled to a shelve file per index under cache_dir. Shelve files are
+# only opened while holding an exclusive lock on <index>.lock, so that they can
+# be shared by several processes.
+class TermVectorsCache:
+    def __init__(self, cache_dir=None, max_bytes=256 * 1024 * 1024):
+        if cache_dir is None:
+            cache_dir = environ.get('DDT_TERMVECTORS_CACHE', join(gettempdir(), 'ddt_termvectors'))
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._memory = OrderedDict()
+        self._bytes = 0
+        self._lock = RLock()
+
+    # Returns the cached values of the documents of index in stamps (a
+    # dictionary doc_id: stamp) which were cached with the same stamp, as a
+    # dictionary doc_id: value.
+    def get(self, index, stamps):
+        values = {}
+        with self._lock:
+            missing = []
+            for doc_id, stamp in stamps.iteritems():
+                entry = self._memory.pop((index, doc_id), None)
+                if entry is None:
+                    missing.append(doc_id)
+                    continue
+                if entry[0] == stamp:
+                    self._memory[(index, doc_id)] = entry
+                    values[doc_id] = entry[1]
+                else:
+                    self._bytes -= entry[2]
+
+            loaded = []
+            if len(missing) > 0 and exists(join(self.cache_dir, index + '.lock')):
+                with self._shelf(index) as shelf:
+                    for doc_id in missing:
+                        entry = shelf.get(self._shelf_key(doc_id))
+                        if entry is None:
+                            continue
+                        if entry[0] != stamps[doc_id]:
+                            del shelf[self._shelf_key(doc_id)]
+                            continue
+                        loaded.append([doc_id, entry])
+
+            for [doc_id, entry] in loaded:
+                self._add((index, doc_id), entry[0], entry[1])
+                values[doc_id] = entry[1]
+        return values
+
+    # Returns the documents of doc_ids with a cached value in index, whatever
+    # its stamp.
+    def contains(self, index, doc_ids):
+        with self._lock:
+            found = set([doc_id for doc_id in doc_ids if (index, doc_id) in self._memory])
+            missing = [doc_id for doc_id in doc_ids if not doc_id in found]
+            if len(missing) > 0 and exists(join(self.cache_dir, index + '.lock')):
+                with self._shelf(index) as shelf:
+                    found.update([doc_id for doc_id in missing if shelf.has_key(self._shelf_key(doc_id))])
+            return found
+
+    def put(self, index, doc_id, stamp, value):
+        with self._lock:
+            self._add((index, doc_id), stamp, value)
+
+    # Spills all in memory entries to disk.
+    def flush(self):
+        with self._lock:
+            self._spill(len(self._memory))
+
+    def close(self):
+        self.flush()
+
+    def _add(self, key, stamp, value):
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._bytes -= old[2]
+
+        size = len(cPickle.dumps(value, cPickle.HIGHEST_PROTOCOL))
+        self._memory[key] = (stamp, value, size)
+        self._bytes += size
+
+        # The least recently used entries are spilled until the others fit,
+        # the last added one is always kept.
+        count = 0
+        remaining = self._bytes
+        for entry in self._memory.itervalues():
+            if remaining <= self.max_bytes or count == len(self._memory) - 1:
+                break
+            remaining -= entry[2]
+            count += 1
+        self._spill(count)
+
+    # Writes the count least recently used entries to disk, one shelve file
+    # opening per index.
+    def _spill(self, count):
+        by_index = {}
+        for _ in xrange(count):
+            (index, doc_id), (stamp, value, size) = self._memory.popitem(last=False)
+            self._bytes -= size
+            by_index.setdefault(index, []).append([doc_id, stamp, value])
+
+        for index, entries in by_index.iteritems():
+            with self._shelf(index) as shelf:
+                for [doc_id, stamp, value] in entries:
+                    shelf[self._shelf_key(doc_id)] = (stamp, value)
+
+    # Opens the shelve file of index while holding its lock.
+    @contextmanager
+    def _shelf(self, index):
+        if not exists(self.cache_dir):
+            makedirs(self.cache_dir)
+        with open(join(self.cache_dir, index + '.lock'), 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                shelf = shelve.open(join(self.cache_dir, index), protocol=cPickle.HIGHEST_PROTOCOL)
+                try:
+                    yield shelf
+                finally:
+                    shelf.close()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    @staticmethod
+    def _shelf_key(doc_id):
+        return doc_id.encode('utf-8') if isinstance(doc_id, unicode) else str(doc_id)
+
+_cache = None
+_cache_lock = RLock()
+
+# Returns the term vectors cache shared by the process.
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = TermVectorsCache()
+            atexit.register(_cache.close)
+    return _cache
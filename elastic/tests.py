@@ -0,0 +1,262 @@
+import re
+import shutil
+import unittest
+import numpy as np
+from itertools import islice
+from tempfile import mkdtemp
+
+import get_mtermvectors
+from get_documents import get_documents
+from generators import urls_generator
+from get_mtermvectors import getTermStatistics, prune_vocabulary
+from termvectors_cache import TermVectorsCache
+from search_documents import range_tags_summary
+
+# Stands for an index of documents {'_id', field: value, ...}, answering the
+# requests get_documents sends, and recording them. The analyzed fields are
+# matched on the lowercase words of their values.
+class FakeIndex:
+    def __init__(self, docs, analyzed=[]):
+        self.docs = docs
+        self.analyzed = analyzed
+        self.searches = []
+        self.multi_gets = []
+
+    def matches(self, doc, field, keys):
+        if field in self.analyzed:
+            return any(word in keys for word in doc.get(field, '').lower().split())
+        return doc.get(field) in keys
+
+    def search(self, query, index=None, doc_type=None, size=10):
+        [[field, keys]] = query['query']['filtered']['filter']['terms'].items()
+        self.searches.append([list(keys), size])
+        hits = [{'_id': doc['_id'],
+                 'fields': {name: [doc[name]] for name in query['fields'] if name in doc}}
+                for doc in self.docs if self.matches(doc, field, keys)]
+        return {'hits': {'total': len(hits), 'hits': hits[:size]}}
+
+    def multi_get(self, ids, index=None, doc_type=None, fields=None):
+        self.multi_gets.append(ids)
+        docs = dict((doc['_id'], doc) for doc in self.docs)
+        return {'docs': [{'_id': id, 'found': True,
+                          'fields': {name: [docs[id][name]] for name in fields if name in docs[id]}}
+                         if id in docs else {'_id': id, 'found': False}
+                         for id in ids]}
+
+class GetDocumentsTest(unittest.TestCase):
+    def setUp(self):
+        self.es = FakeIndex([{'_id': 'u%d' % i, 'url': 'http://%d' % i, 'tag': 'tag%d' % i}
+                             for i in range(10)])
+
+    def test_batches_terms_queries(self):
+        urls = ['http://%d' % i for i in range(10)] + ['http://missing']
+        results = get_documents(urls, 'url', ['tag'], es=self.es, batch_size=4)
+
+        self.assertEqual([size for _, size in self.es.searches], [4, 4, 3])
+        self.assertEqual(sorted(results.keys()), ['http://%d' % i for i in range(10)])
+        for i in range(10):
+            self.assertEqual(results['http://%d' % i], {'tag': 'tag%d' % i})
+
+    def test_fetches_all_documents_sharing_a_key(self):
+        self.es.docs.extend([{'_id': 'd%d' % i, 'url': 'http://dup'} for i in range(3)])
+        self.es.docs.append({'_id': 'd3', 'url': 'http://dup', 'tag': 'last'})
+
+        results = get_documents(['http://dup', 'http://0'], 'url', ['tag'], es=self.es)
+
+        self.assertEqual(len(self.es.searches), 2)
+        self.assertEqual(results['http://dup'], {})
+        self.assertEqual(results['http://0'], {'tag': 'tag0'})
+
+    def test_keys_of_analyzed_fields(self):
+        self.es.docs.extend([{'_id': 't1', 'term': 'Apple', 'tag': 'fruit'},
+                             {'_id': 't2', 'term': 'cherry', 'tag': 'red'}])
+        self.es.analyzed = ['term']
+
+        results = get_documents(['apple', 'cherry', 'banana'], 'term', ['tag'], es=self.es)
+
+        self.assertEqual(results, {'apple': {'tag': 'fruit'}, 'cherry': {'tag': 'red'}})
+        self.assertEqual([keys for keys, _ in self.es.searches],
+                         [['apple', 'cherry', 'banana'], ['apple'], ['banana']])
+
+    def test_multi_gets_ids(self):
+        ids = ['u%d' % i for i in range(10)] + ['missing']
+        results = get_documents(ids, '_id', ['url', 'tag'], es=self.es, batch_size=5)
+
+        self.assertEqual(self.es.multi_gets, [ids[0:5], ids[5:10], ids[10:]])
+        self.assertEqual(self.es.searches, [])
+        self.assertEqual(sorted(results.keys()), sorted(ids[:10]))
+        self.assertEqual(results['u3'], {'url': 'http://3', 'tag': 'tag3'})
+
+    def test_single_key(self):
+        results = get_documents('http://1', 'url', ['tag'], es=self.es)
+        self.assertEqual(results, {'http://1': {'tag': 'tag1'}})
+
+# Stands for an index of pages with the given tag values, answering the
+# aggregation of range_tags_summary. Only the filters it builds are evaluated.
+class FakeTagsIndex:
+    def __init__(self, tags):
+        self.tags = tags
+
+    def matches(self, query, tag):
+        if 'match_all' in query:
+            return True
+        if 'regexp' in query:
+            return tag is not None and re.match(query['regexp']['tag.raw'] + '$', tag) is not None
+        return all(self.matches(q, tag) for q in query['bool'].get('must', [])) and \
+            not any(self.matches(q, tag) for q in query['bool'].get('must_not', []))
+
+    def search(self, query, index=None, doc_type=None):
+        buckets = query['aggs']['tags']['filters']['filters']
+        return {'aggregations': {'tags': {'buckets': {
+            name: {'doc_count': len([tag for tag in self.tags if self.matches(bucket, tag)])}
+            for name, bucket in buckets.items()}}}}
+
+class RangeTagsSummaryTest(unittest.TestCase):
+    def test_matches_whole_tags(self):
+        es = FakeTagsIndex(['Relevant', 'Relevant;Deep', 'Deep;Irrelevant', 'Not Relevant',
+                            'relevant', 'Irrelevant;Relevant', None, 'Deep'])
+        self.assertEqual(range_tags_summary('retrieved', 0, 1, es=es),
+                         {'Relevant': 3, 'Irrelevant': 1, 'Neutral': 4})
+
+    def test_escapes_tags(self):
+        es = FakeTagsIndex(['a.b', 'axb', 'c+'])
+        self.assertEqual(range_tags_summary('retrieved', 0, 1, ['a.b', 'c+'], es=es),
+                         {'a.b': 1, 'c+': 1, 'Neutral': 1})
+
+# Stands for an index of documents {_id: {term: tf}}, with a _version per
+# document, answering the requests of getTermStatistics and recording the ids
+# of the term vectors it fetches. Documents with an empty text have no term
+# vectors.
+class FakeTermVectorsIndex:
+    def __init__(self, docs):
+        self.docs = docs
+        self.versions = dict.fromkeys(docs, 1)
+        self.fetched = []
+
+    def mget(self, index=None, doc_type=None, body=None, _source=None):
+        return {'docs': [{'_id': id, '_version': self.versions[id], 'found': True}
+                         if id in self.docs else {'_id': id, 'found': False}
+                         for id in body['ids']]}
+
+    def mtermvectors(self, index=None, doc_type=None, ids=None, **kwargs):
+        self.fetched.extend(ids)
+        docs = []
+        for id in ids:
+            if not id in self.docs:
+                docs.append({'_id': id, 'found': False})
+                continue
+            doc = {'_id': id, '_version': self.versions[id], 'found': True, 'term_vectors': {}}
+            if len(self.docs[id]) > 0:
+                doc['term_vectors']['text'] = {
+                    'field_statistics': {'doc_count': len(self.docs)},
+                    'terms': {term: {'term_freq': tf, 'doc_freq': 1, 'ttf': tf}
+                              for term, tf in self.docs[id].items()}}
+            docs.append(doc)
+        return {'docs': docs}
+
+class TermVectorsCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = TermVectorsCache(mkdtemp())
+        self._get_cache = get_mtermvectors.get_cache
+        get_mtermvectors.get_cache = lambda: self.cache
+        self.es = FakeTermVectorsIndex({'d1': {'apple': 2}, 'd2': {'banana': 1}, 'empty': {}})
+
+    def tearDown(self):
+        get_mtermvectors.get_cache = self._get_cache
+        shutil.rmtree(self.cache.cache_dir)
+
+    def statistics(self, ids):
+        return getTermStatistics(ids, es=self.es, workers=1)
+
+    def test_cached_until_indexed_again(self):
+        self.statistics(['d1', 'd2', 'empty', 'missing'])
+        self.assertEqual(self.es.fetched, ['d1', 'd2', 'empty', 'missing'])
+
+        # New documents do not invalidate the cached ones, nor do documents
+        # without term vectors need to be fetched again.
+        self.es.docs['d3'] = {'cherry': 1}
+        self.es.versions['d3'] = 1
+        self.es.versions['d2'] = 2
+        del self.es.fetched[:]
+        [_, data_tf, _, corpus, docs] = self.statistics(['d1', 'd2', 'd3', 'empty'])
+        self.assertEqual(self.es.fetched, ['d2', 'd3'])
+        self.assertEqual(docs, ['d1', 'd2', 'd3'])
+        self.assertEqual(sorted(corpus), ['apple', 'banana', 'cherry'])
+        self.assertEqual(data_tf.sum(), 4)
+
+    def test_spilled_entries(self):
+        self.cache.max_bytes = 0
+        self.statistics(['d1', 'd2', 'empty'])
+        del self.es.fetched[:]
+        self.assertEqual(self.statistics(['d1', 'd2', 'empty'])[4], ['d1', 'd2'])
+        self.assertEqual(self.es.fetched, [])
+
+# Stands for an index scrolled through by the generators, returning hits
+# size at a time, and recording the scrolls left to clear.
+class FakeScrollIndex:
+    def __init__(self, hits):
+        self.hits = hits
+        self.open_scrolls = set()
+
+    def search(self, index=None, doc_type=None, body=None, search_type=None, scroll=None, size=10):
+        self.size = size
+        self.open_scrolls.add(0)
+        return {'_scroll_id': 0, 'hits': {'hits': []}}
+
+    def scroll(self, scroll_id=None, scroll=None):
+        start = scroll_id * self.size
+        self.open_scrolls.discard(scroll_id)
+        self.open_scrolls.add(scroll_id + 1)
+        return {'_scroll_id': scroll_id + 1, 'hits': {'hits': self.hits[start:start+self.size]}}
+
+    def clear_scroll(self, scroll_id=None):
+        self.open_scrolls.discard(scroll_id)
+
+class GeneratorsTest(unittest.TestCase):
+    def setUp(self):
+        self.es = FakeScrollIndex([{'_id': 'u%d' % i, 'fields': {'url': ['http://%d' % i]}} for i in range(10)])
+
+    def test_skips_documents_without_field(self):
+        self.es.hits[3] = {'_id': 'u3'}
+        self.es.hits[5] = {'_id': 'u5', 'fields': {}}
+        self.assertEqual(list(urls_generator(self.es, page_size=4)),
+                         ['http://%d' % i for i in range(10) if not i in [3, 5]])
+        self.assertEqual(self.es.open_scrolls, set())
+
+    def test_clears_scroll_when_closed(self):
+        urls = urls_generator(self.es, page_size=4)
+        self.assertEqual(list(islice(urls, 5)), ['http://%d' % i for i in range(5)])
+        urls.close()
+        self.assertEqual(self.es.open_scrolls, set())
+
+class PruneVocabularyTest(unittest.TestCase):
+    def setUp(self):
+        self.df = np.array([1, 5, 3, 3, 9, 2])
+
+    def test_keeps_all_terms_by_default(self):
+        self.assertEqual(prune_vocabulary(self.df, 10).tolist(), [0, 1, 2, 3, 4, 5])
+
+    def test_min_df(self):
+        self.assertEqual(prune_vocabulary(self.df, 10, min_df=3).tolist(), [1, 2, 3, 4])
+
+    def test_max_df(self):
+        self.assertEqual(prune_vocabulary(self.df, 10, max_df=0.5).tolist(), [0, 1, 2, 3, 5])
+        self.assertEqual(prune_vocabulary(self.df, 10, max_df=1.0).tolist(), [0, 1, 2, 3, 4, 5])
+
+    def test_max_features(self):
+        self.assertEqual(prune_vocabulary(self.df, 10, max_features=2).tolist(), [1, 4])
+        self.assertEqual(prune_vocabulary(self.df, 10, max_features=10).tolist(), [0, 1, 2, 3, 4, 5])
+
+    def test_max_features_by_term_frequency(self):
+        tf_sum = np.array([50.0, 1.0, 2.0, 2.0, 3.0, 40.0])
+        self.assertEqual(prune_vocabulary(self.df, 10, max_features=2, tf_sum=tf_sum).tolist(), [0, 5])
+
+    def test_ties_broken_by_column(self):
+        self.assertEqual(prune_vocabulary(self.df, 10, max_features=3).tolist(), [1, 2, 4])
+        self.assertEqual(prune_vocabulary(self.df[::-1], 10, max_features=3).tolist(), [1, 2, 4])
+
+    def test_combined(self):
+        self.assertEqual(prune_vocabulary(self.df, 10, 2, 0.5, 2).tolist(), [1, 2])
+
+if __name__ == '__main__':
+    unittest.main()
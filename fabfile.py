@@ -78,6 +78,16 @@ def runvis():
                 DDT_HOME=PROJ_ROOT):
         local('{python} vis/server.py'.format(**env))
 
+@task
+def benchmark(sizes='1000,10000,100000', output='ranking_benchmark.json', compare=None):
+    "Run the ranking benchmarks on synthetic corpora"
+    with lcd(PROJ_ROOT), \
+      shell_env(NLTK_DATA=env['nltk_data'],
+                PYTHONPATH=env['pythonpath']):
+        local('{python} ranking/benchmark.py --sizes {sizes} --output {output}{compare}'.format(
+            sizes=sizes, output=output,
+            compare=' --compare ' + compare if compare else '', **env))
+
 def create_elastic_mappings():
     "Making sure elastic mappings are created"
     with lcd(PROJ_ROOT + '/elastic'):
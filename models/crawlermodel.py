@@ -1,7 +1,6 @@
 import math
 import time
 import os
-from sklearn.decomposition import PCA
 from random import random, randint
 from pprint import pprint
 from subprocess import call
@@ -11,29 +10,66 @@ from os import chdir, listdir, environ
 from os.path import isfile, join, exists
 import shutil
 import sys
+import threading
+from itertools import islice
 from datetime import datetime
 
 from seeds_generator.download import download, decode
 from seeds_generator.concat_nltk import get_bag_of_words
 
-from pyelasticsearch import ElasticSearch
-from elasticsearch import Elasticsearch
+from elastic.connections import es_server, get_es, get_es_client
 from elastic.get_config import get_available_domains
-from elastic.search_documents import get_context, term_search, search, range
+from elastic.search_documents import get_context, term_search_query, range_tags_summary
 from elastic.add_documents import add_document, update_document
-from elastic.get_mtermvectors import getTermStatistics
-from elastic.get_documents import get_most_recent_documents, get_documents, get_all_ids
+from elastic.get_documents import get_most_recent_documents, get_documents
+from elastic.generators import urls_generator
+from elastic.async_documents import get_documents_async
+from elastic.multi_search import MultiSearch, hits_ids
 from ranking import tfidf, rank, extract_terms
+from ranking.matrix_store import matrix_store
+from projection_worker import acquire_worker, release_worker
+from result_cache import ResultCache
 
 
 
 class CrawlerModel:
+  # Terms summaries by crawler, shared by all models so that tags set through any of them
+  # invalidate the summaries (see getTermsSummarySeedCrawler).
+  _termsSummaries = ResultCache()
+
   def __init__(self):
-    self.es = None
+    self.es = get_es()
     self._activeCrawlerIndex = None
     self._filter = None
     self._pagesCap = int(10E2)
 
+    # Vocabulary pruning of term statistics: terms held by fewer than
+    # _termsMinDf pages or by more than a ratio _termsMaxDf of them are left
+    # out, as are all but the _termsCap most frequent ones.
+    self._termsMinDf = 1
+    self._termsMaxDf = 1.0
+    self._termsCap = int(2E4)
+
+    # Pages sampled from the stream of all pages when no page is tagged relevant
+    # and no model of the whole index was saved (see getTermsSummarySeedCrawler).
+    self._termsSampleCap = int(1E5)
+
+    # Saved tf-idf models of the crawler indices, read instead of fetching the
+    # term statistics of their pages (see ranking/matrix_store.py).
+    self._matrixStore = matrix_store()
+
+    # Background worker writing the x, y coordinates of the pages of the
+    # active crawler (see ProjectionWorker).
+    self._projectionWorker = None
+
+    # Tags set on pages, [url, tags], in order, for getPages deltas. The first
+    # _tagEditsDropped edits are dropped once there are more than _tagEditsCap. Request threads
+    # share them, under _tagEditsLock.
+    self._tagEditsLock = threading.Lock()
+    self._tagEdits = []
+    self._tagEditsDropped = 0
+    self._tagEditsCap = int(1E4)
+
     # TODO(Yamuna): delete when not returning random data anymore.
     self._randomTerms = {
       'Word': ['Word', randint(1, 100), randint(1, 100), ['Positive']],
@@ -52,10 +88,8 @@ class CrawlerModel:
   #   ...
   # ]
   def getAvailableCrawlers(self):
-    # TODO(Yamuna): Fix to point to correct elastic search.
     # Initializes elastic search.
-    self.es = ElasticSearch( \
-    os.environ['ELASTICSEARCH_SERVER'] if 'ELASTICSEARCH_SERVER' in os.environ else 'http://localhost:9200')
+    self.es = get_es()
 
     domains = get_available_domains(self.es)
     return \
@@ -71,8 +105,7 @@ class CrawlerModel:
   # ]
   def getAvailableSeedCrawlers(self):
     # Initializes elastic search.
-    self.es = ElasticSearch( \
-    os.environ['ELASTICSEARCH_SERVER'] if 'ELASTICSEARCH_SERVER' in os.environ else 'http://localhost:9200')
+    self.es = get_es()
 
     domains = get_available_domains(self.es)
     return \
@@ -84,6 +117,14 @@ class CrawlerModel:
     print 'SET ACTIVE CRAWLER'
     self._activeCrawlerIndex = crawlerId
     self._filter = None
+    self.resetTagEdits()
+
+    # The new worker is acquired first, so that the worker of the same crawler keeps running.
+    previous = self._projectionWorker
+    self._projectionWorker = acquire_worker(crawlerId, 'page', opt_minDf=self._termsMinDf,
+                                            opt_maxDf=self._termsMaxDf, opt_maxFeatures=self._termsCap)
+    if not previous is None:
+      release_worker(previous)
 
   # Returns number of pages downloaded between ts1 and ts2 for active crawler.
   # ts1 and ts2 are Unix epochs (seconds after 1970).
@@ -156,38 +197,10 @@ class CrawlerModel:
     else:
       opt_ts2 = float(opt_ts2)
     
-    if opt_applyFilter:
-    # TODO(Yamuna): apply filter if it is None. Otherwise, match_all.
-      results = \
-      range('retrieved',opt_ts1, opt_ts2, ['url','tag'], True, self._activeCrawlerIndex, es=self.es)
-    else:
-      results = \
-      range('retrieved',opt_ts1, opt_ts2, ['url','tag'], True, self._activeCrawlerIndex, es=self.es)
-
-    relevant = 0
-    irrelevant = 0
-    neutral = 0
-
-    # TODO(Yamuna): Double check the return values for crawler
-    for res in results:
-        try:
-          tags = res['tag']
-          if 'Relevant' in res['tag']:
-            relevant = relevant + 1
-          elif 'Irrelevant' in res['tag']:
-            irrelevant = irrelevant + 1
-          else:
-            # Page has tags, but not Relevant or Irrelevant.
-            neutral = neutral + 1
-        except KeyError:
-          # Page does not have tags.
-          neutral = neutral + 1
+    opt_filter = self._filter if opt_applyFilter else None
 
-    return { \
-      'Relevant': relevant,
-      'Irrelevant': irrelevant,
-      'Neutral': neutral
-    }
+    return range_tags_summary('retrieved', opt_ts1, opt_ts2, ['Relevant', 'Irrelevant'], True, \
+                              opt_filter, self._activeCrawlerIndex, 'page', self.es)
 
 
 
@@ -214,23 +227,53 @@ class CrawlerModel:
   #   [term, frequencyInRelevantPages, frequencyInIrrelevantPages, tags],
   #   ...
   # ]
+  #
+  # Summaries are cached by crawler, and only computed again when new pages are retrieved or tags
+  # are set on pages or terms (see setPagesTag and setTermsTag). They are then computed in the
+  # background, and the last summary is returned meanwhile.
   def getTermsSummarySeedCrawler(self, opt_maxNumberOfTerms = 50):
+    es_index = self._activeCrawlerIndex
+
+    # The time the most recent page was retrieved tells whether pages were added since.
+    hits = get_most_recent_documents(1, ["retrieved"], None, es_index, 'page', self.es)
+    last_retrieved = None
+    if len(hits) > 0 and not hits[0].get('retrieved') is None:
+      last_retrieved = hits[0]['retrieved'][0]
+
+    return CrawlerModel._termsSummaries.get(es_index,
+                                            lambda: self.computeTermsSummarySeedCrawler(es_index, opt_maxNumberOfTerms),
+                                            [last_retrieved, opt_maxNumberOfTerms])
+
+  # Computes the terms summary of crawler es_index, as getTermsSummarySeedCrawler.
+  def computeTermsSummarySeedCrawler(self, es_index, opt_maxNumberOfTerms = 50):
 
     terms = []
 
-    pos_urls = term_search('tag', ['Relevant'], self._activeCrawlerIndex, 'page', self.es)
+    # Relevant and irrelevant pages are looked up in a single request.
+    msearch = MultiSearch()
+    msearch.add(term_search_query('tag', ['Relevant']), es_index, 'page', 500, hits_ids)
+    msearch.add(term_search_query('tag', ['Irrelevant']), es_index, 'page', 500, hits_ids)
+    [pos_urls, neg_urls] = msearch.execute()
+
     pos_urls_found = True
+    tfidf_h = tfidf.tfidf(None, es_index, 'page', opt_min_df=self._termsMinDf, opt_max_df=self._termsMaxDf,
+                          opt_max_features=self._termsCap, opt_store=self._matrixStore)
     if len(pos_urls) == 0:
-      pos_urls = get_all_ids(self._activeCrawlerIndex, 'page', self.es)
+      # Terms of the whole index are read from its saved model, or else from a sample of its pages.
+      if tfidf_h.load():
+        pos_urls = tfidf_h.documents
+      else:
+        pos_urls = list(islice(urls_generator(get_es_client(), es_index, 'page'), self._termsSampleCap))
       pos_urls_found = False
 
     if len(pos_urls) > 1:
 
-      tfidf_h = tfidf.tfidf(pos_urls)
+      tfidf_h.add_documents(pos_urls)
       extract_terms_h = extract_terms.extract_terms(tfidf_h)
       top_terms = extract_terms_h.getTopTerms(opt_maxNumberOfTerms)
 
-      tags = get_documents(top_terms, 'term', ['tag'], self._activeCrawlerIndex, 'terms', self.es)
+      # Terms tags are fetched while term statistics of irrelevant pages are computed.
+      tags_res = get_documents_async(top_terms, 'term', ['tag'], es_index, 'terms', self.es)
 
       pos_freq = {}
       if pos_urls_found:
@@ -239,15 +282,15 @@ class CrawlerModel:
       else:
         pos_freq = { key: 0 for key in top_terms }      
 
-      neg_urls = term_search('tag', ['Irrelevant'], self._activeCrawlerIndex, 'page', self.es)
       neg_freq = {}
       if len(neg_urls) > 1:
-        tfidf_h = tfidf.tfidf(neg_urls)
+        tfidf_h = tfidf.tfidf(neg_urls, es_index, 'page', opt_store=self._matrixStore)
         ttfs = tfidf_h.getTtf()
         neg_freq = { key: 0 if ttfs.get(key) is None else ttfs.get(key) for key in top_terms }      
       else:
         neg_freq = { key: 0 for key in top_terms }      
 
+      tags = tags_res.get()
       for term in top_terms:
         entry = [term, pos_freq[term], neg_freq[term], []]
         if not tags.get(term) is None:
@@ -259,6 +302,7 @@ class CrawlerModel:
   # Sets limit to pages returned by @getPages.
   def setPagesCountCap(self, pagesCap):
     self._pagesCap = int(pagesCap)
+    self.resetTagEdits()
 
   # Returns most recent downloaded pages.
   # Returns dictionary in the format:
@@ -270,12 +314,118 @@ class CrawlerModel:
   #             [url3, x, y, tags, retrieved],
   #   ]
   # }
-  def getPages(self):
+  #
+  # x and y are written to the pages in the background by the projection worker of the active
+  # crawler, pages it has not placed yet are at 0, 0.
+  #
+  # Also returns 'last_tag_edit' and 'last_position', to pass with last_downloaded_url_epoch to
+  # the next call, 'pages_cap', the maximum number of pages returned, and 'delta': False.
+  #
+  # If opt_lastUpdate, opt_lastTagEdit and opt_lastPosition (last_downloaded_url_epoch,
+  # last_tag_edit and last_position of a previous response) are given, returns only the pages
+  # retrieved since then, the tags of pages tagged since then, and the positions of pages placed
+  # since then:
+  # {
+  #   'last_downloaded_url_epoch': 1432310403 (in seconds)
+  #   'last_tag_edit': 12,
+  #   'last_position': 1500,
+  #   'pages_cap': 1000,                      (most recent pages to keep once merged)
+  #   'delta': True,
+  #   'pages': [[url1, x, y, tags], ...],     (new pages)
+  #   'tags': [[url1, tags], ...],            (pages tagged since opt_lastTagEdit)
+  #   'positions': [[url1, x, y], ...],       (pages placed since opt_lastPosition)
+  # }
+  # A complete response is returned instead when the previous one can not be updated: when
+  # there are as many new pages as the cap, or the tag edits or positions were reset since (see
+  # setActiveCrawler, applyFilter, setPagesCountCap and ProjectionWorker.fit).
+  def getPages(self, opt_lastUpdate = None, opt_lastTagEdit = None, opt_lastPosition = None):
+    [tag_edits, last_tag_edit] = self._tagEditsSince(opt_lastTagEdit)
+    positions = None
+    if not self._projectionWorker is None:
+      positions = self._projectionWorker.getPositionsSince(opt_lastPosition)
+    if opt_lastUpdate is None or tag_edits is None or positions is None:
+      return self.getAllPages()
+
+    hits = get_most_recent_documents(self._pagesCap, ["url", "x", "y", "tag", "retrieved"],
+                                     self._filter, self._activeCrawlerIndex, 'page', \
+                                     self.es, float(opt_lastUpdate))
+    if len(hits) >= self._pagesCap:
+      return self.getAllPages()
+
+    docs = CrawlerModel.pagesFromHits(hits)
+
+    last_download_epoch = float(opt_lastUpdate)
+    if len(docs) > 0:
+      last_download_epoch = CrawlerModel.convert_to_epoch(datetime.strptime(docs[0][4], '%Y-%m-%dT%H:%M:%S.%f'))
+
+    return {\
+            'last_downloaded_url_epoch': last_download_epoch,
+            'last_tag_edit': last_tag_edit,
+            'last_position': int(opt_lastPosition) + len(positions),
+            'pages_cap': self._pagesCap,
+            'delta': True,
+            'pages': [page[:4] for page in docs],
+            'tags': tag_edits,
+            'positions': positions
+          }
+
+  # Returns all most recent downloaded pages, as getPages.
+  def getAllPages(self):
+    # Read first, so that pages placed or tagged in between are sent again by the next delta.
+    last_tag_edit = self._tagEditsSince(None)[1]
+    last_position = None
+    if not self._projectionWorker is None:
+      last_position = self._projectionWorker.lastPosition()
 
     hits = get_most_recent_documents(self._pagesCap, ["url", "x", "y", "tag", "retrieved"], 
                                      self._filter, self._activeCrawlerIndex, 'page', \
                                      self.es)
 
+    docs = CrawlerModel.pagesFromHits(hits)
+
+    # Gets last downloaded url epoch from top result (most recent one).
+    last_downloaded_url_epoch = 0
+    if len(docs) > 0:
+      last_downloaded_url_epoch = docs[0][4]
+
+      last_download_epoch = CrawlerModel.convert_to_epoch(datetime.strptime(last_downloaded_url_epoch, '%Y-%m-%dT%H:%M:%S.%f'))
+      return {\
+              'last_downloaded_url_epoch': last_download_epoch,
+              'last_tag_edit': last_tag_edit,
+              'last_position': last_position,
+              'pages_cap': self._pagesCap,
+              'delta': False,
+              'pages': [page[:4] for page in docs]
+            }
+    else:
+      return {}
+
+  # Returns the [url, tags] of the pages tagged since the tag edit lastTagEdit, or None if
+  # they are not all known anymore.
+  def getTagEditsSince(self, lastTagEdit):
+    return self._tagEditsSince(lastTagEdit)[0]
+
+  # Returns [edits, lastTagEdit]: the edits since the tag edit lastTagEdit, as
+  # getTagEditsSince, and the cursor of the last edit, read at once.
+  def _tagEditsSince(self, lastTagEdit):
+    with self._tagEditsLock:
+      last = self._tagEditsDropped + len(self._tagEdits)
+      if lastTagEdit is None:
+        return [None, last]
+      start = int(lastTagEdit) - self._tagEditsDropped
+      if start < 0 or start > len(self._tagEdits):
+        return [None, last]
+      return [self._tagEdits[start:], last]
+
+  # Drops all tag edits, so that the next getPages returns all pages.
+  def resetTagEdits(self):
+    with self._tagEditsLock:
+      self._tagEditsDropped += len(self._tagEdits) + 1
+      self._tagEdits = []
+
+  # Converts hits of get_most_recent_documents to pages [url, x, y, tags, retrieved].
+  @staticmethod
+  def pagesFromHits(hits):
     docs = []
     for i, hit in enumerate(hits):
       doc = ["", 0, 0, [], 0]
@@ -290,26 +440,7 @@ class CrawlerModel:
       if not hit.get('retrieved') is None:
         doc[4] = hit['retrieved'][0]
       docs.append(doc)
-
-    # Gets last downloaded url epoch from top result (most recent one).
-    last_downloaded_url_epoch = 0
-    if len(docs) > 0:
-      last_downloaded_url_epoch = docs[0][4]
-
-      # Prepares results: computes projection.
-      # TODO(Yamuna): Update x, y for pages after projection is done.
-      projectionData = self.projectPages(docs)
-
-      # TODO(Yamuna): Fill x and y returned by projection.
-      #crawlermodeladapter.runpcasklearn(pos_data, pc_count)
-
-      last_download_epoch = CrawlerModel.convert_to_epoch(datetime.strptime(last_downloaded_url_epoch, '%Y-%m-%dT%H:%M:%S.%f'))
-      return {\
-              'last_downloaded_url_epoch': last_download_epoch,
-              'pages': [page[:4] for page in docs]
-            }
-    else:
-      return {}
+    return docs
 
   # Boosts set of pages: crawler exploits outlinks for the given set of pages in active crawler.
   def boostPages(self, pages):
@@ -368,6 +499,15 @@ class CrawlerModel:
 
     update_document(entries, 'url', self._activeCrawlerIndex, 'page', self.es)
 
+    with self._tagEditsLock:
+      for entry in entries:
+        self._tagEdits.append([entry['url'], entry['tag'].split(';')])
+      if len(self._tagEdits) > self._tagEditsCap:
+        dropped = len(self._tagEdits) - self._tagEditsCap / 2
+        self._tagEdits = self._tagEdits[dropped:]
+        self._tagEditsDropped += dropped
+
+    self.invalidateTermsSummary()
 
   # Adds tag to terms (if applyTagFlag is True) or removes tag from terms (if applyTagFlag is
   # False).
@@ -429,6 +569,15 @@ class CrawlerModel:
     if update_entries:
       update_document(update_entries, 'term', self._activeCrawlerIndex, 'terms', self.es)
 
+    self.invalidateTermsSummary()
+
+  # Computes the terms summary of the active crawler again, in the background. The index is
+  # refreshed first there, so that the summary sees the tags just set.
+  def invalidateTermsSummary(self):
+    es_index = self._activeCrawlerIndex
+    es = self.es
+    CrawlerModel._termsSummaries.invalidate(es_index, lambda: es.refresh(es_index))
+
   # Submits a web query for a list of terms, e.g. 'ebola disease'
   def queryWeb(self, terms, max_url_count = 100):
     # TODO(Yamuna): Issue query on the web: results are stored in elastic search, nothing returned
@@ -445,7 +594,7 @@ class CrawlerModel:
     print output
     print errors
     
-    download("results.txt", self._activeCrawlerIndex, "page", os.environ['ELASTICSEARCH_SERVER'] if 'ELASTICSEARCH_SERVER' in os.environ else 'http://localhost:9200')
+    download("results.txt", self._activeCrawlerIndex, "page", es_server)
 
 
 
@@ -455,43 +604,9 @@ class CrawlerModel:
     # (when the optional flag is set to True). Check those methods signatures.
     if terms:
       self._filter = terms
+      self.resetTagEdits()
 
 
-  # Projects pages.
-  def projectPages(self, pages):
-    return self.pcaProjectPages(pages)
-    
-  # Projects pages with PCA.
-  def pcaProjectPages(self, pages):
-    
-    # TODO(Yamuna): compute tfidf for pages, compute projection, fill x, y.
-    urls = [page[0] for page in pages]
-    [_, _, data] = self.term_tfidf(urls)
-    
-    pca_count = 2
-    pcadata = CrawlerModel.runPCASKLearn(data, pca_count)
-
-    for i, page in enumerate(pages):
-      if i >= len(pcadata[1]):
-        break;
-      page[1] = pcadata[1][i][0]
-      page[2] = pcadata[1][i][1]
-
-    return pages
-    
-  def term_tfidf(self, urls):
-    es_server = Elasticsearch( \
-    os.environ['ELASTICSEARCH_SERVER'] if 'ELASTICSEARCH_SERVER' in os.environ else 'http://localhost:9200')
-
-    [data, _ , _ , corpus] = getTermStatistics(urls, self._activeCrawlerIndex, 'page', es_server)
-    return [urls, corpus, data.toarray()]
-
-  @staticmethod
-  def runPCASKLearn(X, pc_count = None):
-    pca = PCA(n_components=pc_count)
-    pca.fit(X)
-    return [pca.explained_variance_ratio_.tolist(), pca.transform(X).tolist()]
-
   @staticmethod
   def convert_to_epoch(dt):
     epoch = datetime.utcfromtimestamp(0)
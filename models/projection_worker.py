@@ -0,0 +1,265 @@
+import threading
+import traceback
+import numpy as np
+from os import environ, makedirs, rename
+from os.path import exists, join
+from tempfile import gettempdir
+from scipy.sparse import csr_matrix
+
+from elastic.connections import get_es, get_es_client
+from elastic.search_documents import missing_search
+from elastic.add_documents import update_document
+from elastic.get_mtermvectors import getTermStatistics
+from elastic.get_documents import get_documents, get_most_recent_documents
+from elastic.generators import ids_generator
+from ranking.near_duplicates import near_duplicates
+from ranking.projection import pca_fit, pca_transform
+
+__export__ = ['ProjectionWorker', 'acquire_worker', 'release_worker']
+
+
+# Background thread computing the x, y coordinates of the pages of a crawler index, and writing
+# them back to the pages with bulk partial updates.
+#
+# The projection basis (PCA of the tf-idf matrix of the opt_fitSize most recent pages, near
+# duplicates counted once) is saved to opt_storeDir (DDT_PROJECTION_STORE by default), so that
+# coordinates stay comparable across restarts. It is fitted again, and all pages placed again, while
+# it was fitted on fewer than opt_fitSize pages and the index holds twice as many pages as that. A
+# fit failing for lack of pages with term vectors is tried again on the same condition.
+# Otherwise, every opt_interval seconds the worker looks up up to opt_batchSize pages without
+# coordinates, and places them in the basis, without fitting it again: terms not in the basis are
+# left out. Pages without term vectors are placed at the origin, so that they are not looked up
+# again.
+#
+# Only pages whose coordinates changed are written, since each write creates a new version of the
+# page (and invalidates its cached term vectors). Written pages are logged, [url, x, y], in order,
+# for getPages deltas (see getPositionsSince).
+class ProjectionWorker(threading.Thread):
+  def __init__(self, es_index, es_doc_type = 'page', opt_interval = 5, opt_batchSize = 500,
+               opt_fitSize = 2000, opt_minDf = 1, opt_maxDf = 1.0, opt_maxFeatures = int(2E4),
+               opt_storeDir = None):
+    threading.Thread.__init__(self, name = 'projection-' + es_index)
+    self.daemon = True
+
+    self.es_index = es_index
+    self.es_doc_type = es_doc_type
+    self.interval = opt_interval
+    self.batchSize = opt_batchSize
+    self.fitSize = opt_fitSize
+    self.minDf = opt_minDf
+    self.maxDf = opt_maxDf
+    self.maxFeatures = opt_maxFeatures
+
+    if opt_storeDir is None:
+      opt_storeDir = environ.get('DDT_PROJECTION_STORE', join(gettempdir(), 'ddt_projections'))
+    self.storeDir = opt_storeDir
+
+    self.es = get_es()
+    self._stopped = threading.Event()
+
+    # [vocabulary, mean, components, fitted] of the basis, vocabulary mapping terms to columns, and
+    # fitted being the number of most recent pages it was fitted from.
+    self._basis = None
+    # Number of most recent pages of the last fit which failed for lack of pages with term vectors,
+    # or None.
+    self._failedFit = None
+
+    # Placed pages, [url, x, y]. The first _positionsDropped are dropped once there are more than
+    # _positionsCap.
+    self._lock = threading.Lock()
+    self._positions = []
+    self._positionsDropped = 0
+    self._positionsCap = int(1E4)
+
+    # Number of models using the worker (see acquire_worker).
+    self._users = 0
+
+  def run(self):
+    while not self._stopped.is_set():
+      try:
+        count = self.update()
+      except Exception:
+        print 'PROJECTION OF', self.es_index, 'FAILED'
+        traceback.print_exc()
+        count = 0
+
+      # Keeps going without waiting while there is a backlog of pages to place.
+      if count < self.batchSize:
+        self._stopped.wait(self.interval)
+
+  def stop(self):
+    self._stopped.set()
+
+  # Places the next batch of pages without coordinates. The basis is loaded, or fitted (and all
+  # pages of the index placed in it), first. Returns the number of pages placed.
+  def update(self):
+    if self._basis is None:
+      self._basis = self.loadBasis()
+    if self._basis is None:
+      if self._failedFit is None or self.indexGrew(self._failedFit):
+        return self.fit()
+      return 0
+
+    fitted = self._basis[3]
+    if fitted < self.fitSize and self.indexGrew(fitted):
+      return self.fit()
+
+    urls = missing_search('x', self.batchSize, self.es_index, self.es_doc_type, self.es)
+    return self.place(urls)
+
+  # Returns whether the index holds enough pages to fit the basis again, after a fit from fitted
+  # pages: opt_fitSize, or twice as many.
+  def indexGrew(self, fitted):
+    count = get_es_client().count(index=self.es_index, doc_type=self.es_doc_type)['count']
+    return count >= min(self.fitSize, max(1, 2 * fitted))
+
+  # Fits the basis on the most recent pages, saves it, and places all pages of the index in it.
+  # Returns the number of pages placed.
+  def fit(self):
+    hits = get_most_recent_documents(self.fitSize, ['url'], None, self.es_index, self.es_doc_type, self.es)
+    urls = [hit['url'][0] for hit in hits if not hit.get('url') is None]
+
+    [data, _, _, corpus, urls] = getTermStatistics(urls, self.es_index, self.es_doc_type, get_es_client(),
+                                                    min_df=self.minDf, max_df=self.maxDf,
+                                                    max_features=self.maxFeatures)
+    if len(urls) < 2:
+      self._failedFit = len(hits)
+      return 0
+    self._failedFit = None
+
+    duplicates = near_duplicates()
+    duplicates.add(urls, data, corpus)
+    unique = [i for i, representative in enumerate(duplicates.getRepresentatives(urls))
+              if representative == urls[i]]
+
+    [mean, components, _] = pca_fit(data[unique], 2, True)
+    self.saveBasis(corpus, mean, components, len(hits))
+    self._basis = [{term: i for i, term in enumerate(corpus)}, mean, components, len(hits)]
+
+    # Positions placed in a previous basis are not comparable anymore.
+    with self._lock:
+      self._positionsDropped += len(self._positions) + 1
+      self._positions = []
+
+    count = 0
+    batch = []
+    for url in ids_generator(get_es_client(), self.es_index, self.es_doc_type):
+      if self._stopped.is_set():
+        break
+      batch.append(url)
+      if len(batch) == self.batchSize:
+        count += self.place(batch)
+        batch = []
+    if len(batch) > 0 and not self._stopped.is_set():
+      count += self.place(batch)
+    return count
+
+  # Places pages urls in the basis, and writes the coordinates which changed. Returns the number of
+  # pages placed.
+  def place(self, urls):
+    if len(urls) == 0:
+      return 0
+
+    [vocabulary, mean, components, _] = self._basis
+
+    [data, _, _, corpus, found] = getTermStatistics(urls, self.es_index, self.es_doc_type, get_es_client())
+
+    positions = {}
+    if len(found) > 0:
+      columns = np.array([vocabulary.get(term, -1) for term in corpus], dtype=np.int64)
+      data = csr_matrix(data)
+      known = columns[data.indices] >= 0
+      rows = np.repeat(np.arange(data.shape[0]), np.diff(data.indptr))
+      data = csr_matrix((data.data[known], (rows[known], columns[data.indices][known])),
+                        shape=(data.shape[0], len(vocabulary)))
+      positions = dict(zip(found, pca_transform(data, mean, components).tolist()))
+
+    # Coordinates are stored as floats, and compared as such.
+    current = get_documents(urls, '_id', ['x', 'y'], self.es_index, self.es_doc_type, self.es)
+
+    entries = []
+    for url in urls:
+      [x, y] = positions.get(url, [0, 0])
+      previous = current.get(url, {})
+      if np.float32(previous.get('x')) == np.float32(x) and np.float32(previous.get('y')) == np.float32(y):
+        continue
+      entries.append({'url': url, 'x': x, 'y': y})
+
+    if len(entries) == 0:
+      return len(urls)
+
+    update_document(entries, 'url', self.es_index, self.es_doc_type, self.es)
+
+    with self._lock:
+      self._positions.extend([[entry['url'], entry['x'], entry['y']] for entry in entries])
+      if len(self._positions) > self._positionsCap:
+        dropped = len(self._positions) - self._positionsCap / 2
+        self._positions = self._positions[dropped:]
+        self._positionsDropped += dropped
+
+    return len(urls)
+
+  # Returns the cursor of the last placed page, to pass to getPositionsSince.
+  def lastPosition(self):
+    with self._lock:
+      return self._positionsDropped + len(self._positions)
+
+  # Returns the [url, x, y] of the pages placed since the cursor lastPosition, or None if they are
+  # not all known anymore.
+  def getPositionsSince(self, lastPosition):
+    if lastPosition is None:
+      return None
+    with self._lock:
+      start = int(lastPosition) - self._positionsDropped
+      if start < 0 or start > len(self._positions):
+        return None
+      return self._positions[start:]
+
+  def basisPath(self):
+    return join(self.storeDir, self.es_index + '.npz')
+
+  # Returns the saved basis of the index as [vocabulary, mean, components, fitted], or None. Bases
+  # saved without the number of pages they were fitted on are fitted again.
+  def loadBasis(self):
+    if not exists(self.basisPath()):
+      return None
+    with open(self.basisPath(), 'rb') as f:
+      saved = np.load(f)
+      corpus = saved['corpus'].tolist()
+      fitted = int(saved['fitted']) if 'fitted' in saved.files else 0
+      return [{term: i for i, term in enumerate(corpus)}, saved['mean'], saved['components'], fitted]
+
+  def saveBasis(self, corpus, mean, components, fitted):
+    if not exists(self.storeDir):
+      makedirs(self.storeDir)
+    path = self.basisPath()
+    with open(path + '.tmp', 'wb') as f:
+      np.savez(f, corpus=np.array(corpus), mean=mean, components=components, fitted=fitted)
+    rename(path + '.tmp', path)
+
+
+# Running workers, by index. Models sharing an index share its worker.
+_workers = {}
+_workers_lock = threading.Lock()
+
+# Returns the worker of es_index, started if it is not running yet. Options are those of
+# ProjectionWorker, and only apply to a new worker. Each call must be matched by a call to
+# release_worker.
+def acquire_worker(es_index, es_doc_type = 'page', **options):
+  with _workers_lock:
+    worker = _workers.get(es_index)
+    if worker is None or not worker.is_alive():
+      worker = ProjectionWorker(es_index, es_doc_type, **options)
+      worker.start()
+      _workers[es_index] = worker
+    worker._users += 1
+    return worker
+
+# Stops worker once no model uses it anymore.
+def release_worker(worker):
+  with _workers_lock:
+    worker._users -= 1
+    if worker._users <= 0:
+      worker.stop()
+      if _workers.get(worker.es_index) is worker:
+        del _workers[worker.es_index]
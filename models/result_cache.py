@@ -0,0 +1,92 @@
+import threading
+import traceback
+
+__export__ = ['ResultCache']
+
+
+# Caches results which are slow to compute, by key, and recomputes them in the background when
+# they are invalidated: the last good result is returned meanwhile.
+#
+#   summary = cache.get(crawlerId, lambda: computeSummary(crawlerId), opt_stamp=lastRetrieved)
+#
+# A result is invalidated by invalidate(key), or when get is called with a stamp different from
+# the one of the previous call (e.g. the time the most recent page was retrieved). Only the first
+# call for a key computes its result in the calling thread.
+#
+# invalidate takes a function to call in the background before computing the result again, e.g. to
+# refresh the index it is computed from.
+class ResultCache:
+  def __init__(self):
+    self._lock = threading.Lock()
+    # Entries by key: {'result', 'compute', 'stamp', 'version', 'computed', 'running', 'prepare'},
+    # version being incremented by each invalidation, computed the version of result, and prepare
+    # the functions to call before computing it again.
+    self._entries = {}
+
+  # Returns the result of compute() for key.
+  def get(self, key, compute, opt_stamp = None):
+    with self._lock:
+      entry = self._entries.get(key)
+      if not entry is None:
+        entry['compute'] = compute
+        if entry['stamp'] != opt_stamp:
+          entry['stamp'] = opt_stamp
+          entry['version'] += 1
+        self._start(key, entry)
+        return entry['result']
+
+    result = compute()
+
+    with self._lock:
+      if not key in self._entries:
+        self._entries[key] = {'result': result, 'compute': compute, 'stamp': opt_stamp,
+                              'version': 0, 'computed': 0, 'running': False, 'prepare': []}
+    return result
+
+  # Marks the result of key as stale, and starts computing it again in the background, after
+  # calling opt_prepare() (if not None) there.
+  def invalidate(self, key, opt_prepare = None):
+    with self._lock:
+      entry = self._entries.get(key)
+      if not entry is None:
+        entry['version'] += 1
+        if not opt_prepare is None:
+          entry['prepare'].append(opt_prepare)
+        self._start(key, entry)
+
+  # Starts computing the result of a stale entry, unless it is being computed already. Called with
+  # the lock held.
+  def _start(self, key, entry):
+    if entry['running'] or entry['computed'] == entry['version']:
+      return
+    entry['running'] = True
+    thread = threading.Thread(target=self._refresh, args=(key, entry), name='result-cache-refresh')
+    thread.daemon = True
+    thread.start()
+
+  # Computes the result of entry until it is up to date with its last invalidation.
+  def _refresh(self, key, entry):
+    while True:
+      with self._lock:
+        version = entry['version']
+        compute = entry['compute']
+        prepare = entry['prepare']
+        entry['prepare'] = []
+
+      try:
+        for function in prepare:
+          function()
+        result = compute()
+      except Exception:
+        print 'COMPUTING', key, 'FAILED'
+        traceback.print_exc()
+        with self._lock:
+          entry['running'] = False
+        return
+
+      with self._lock:
+        entry['result'] = result
+        entry['computed'] = version
+        if entry['version'] == version:
+          entry['running'] = False
+          return
@@ -17,6 +17,7 @@ from elastic.search_documents import get_context, term_search, search
 from elastic.add_documents import update_document
 from elastic.get_mtermvectors import getTermStatistics
 from ranking import tfidf, rank, extract_terms
+from ranking.matrix_store import matrix_store
 
 
 class SeedCrawlerModel:
@@ -32,7 +33,15 @@ class SeedCrawlerModel:
         self.urls_set = set(urls)
         self.positive_urls_set = set()
         self.negative_urls_set = set()
-        self.tfidf = tfidf.tfidf()
+        # Vocabulary pruning of term statistics: terms held by fewer than
+        # terms_min_df pages or by more than a ratio terms_max_df of them are
+        # left out, as are all but the terms_cap most frequent ones.
+        self.terms_min_df = 1
+        self.terms_max_df = 1.0
+        self.terms_cap = 20000
+        self.tfidf = tfidf.tfidf(opt_collapse_duplicates=True, opt_min_df=self.terms_min_df,
+                                 opt_max_df=self.terms_max_df, opt_max_features=self.terms_cap,
+                                 opt_store=matrix_store())
         self.memex_home = environ['MEMEX_HOME']
 
  
@@ -84,16 +93,19 @@ class SeedCrawlerModel:
         for url in urls:
             self.urls_set.add(url)
 
-        self.tfidf = tfidf.tfidf(list(self.urls_set))
+        # Only the term statistics of new urls are fetched.
+        self.tfidf.add_documents(list(self.urls_set))
 
         return urls #Results from Search Engine
         
     
-    def submit_selected_urls(self, positive, negative):
+    def submit_selected_urls(self, positive, negative, opt_count = None, opt_offset = 0):
     #Perform ranking and diversifing on all urls with regard to the positive urls
     #
     #Args:
     #   labeled_urls: a list of pair <url, label>. Label 1 means positive and 0 means negative.
+    #   opt_count: number of ranked urls returned, starting from rank opt_offset. All urls are
+    #   returned if None.
     #Returns:
     #   urls: list of urls with ranking scores
 
@@ -142,7 +154,10 @@ class SeedCrawlerModel:
         chdir(self.memex_home + '/seed_crawler/ranking')
         ranker = rank.rank()
         
-        [ranked_urls,scores] = ranker.results(self.tfidf,self.positive_urls_set, other)
+        if opt_count is None:
+            [ranked_urls,scores] = ranker.results(self.tfidf,self.positive_urls_set, other)
+        else:
+            [ranked_urls,scores] = ranker.topResults(self.tfidf,self.positive_urls_set, other, opt_count, opt_offset)
         return [ranked_urls, scores] # classified, ranked, diversified 
 
     def extract_terms(self, count):
@@ -168,16 +183,19 @@ class SeedCrawlerModel:
 
     def term_tfidf(self):
         urls = list(self.urls_set)
-        [data, corpus] = getTermStatistics(urls)
+        [data, _, _, corpus, urls] = getTermStatistics(urls, min_df=self.terms_min_df, max_df=self.terms_max_df,
+                                                       max_features=self.terms_cap)
         #all_docs = get_bag_of_words(list(self.urls_set))
         #return tfidf.tfidf(all_docs).getTfidfArray()
         return [urls, corpus, data.toarray()]
 
-    def submit_selected_terms(self, positive, negative):
+    def submit_selected_terms(self, positive, negative, opt_count = None, opt_offset = 0):
     #Rerank the terms based on the labeled terms
     #
     #Args:
     #   labeled_terms: list of pair of term and label: <term, label>. Label 1 means postive, 0 means negative.
+    #   opt_count: number of ranked terms returned, starting from rank opt_offset. All terms are
+    #   returned if None.
     #Returns:
     #   terms: list of newly ranked terms and their ranking scores
 
@@ -211,9 +229,18 @@ class SeedCrawlerModel:
                     f.write(choice+'\n')
 
         extract = extract_terms.extract_terms(self.tfidf)
-        [ranked_terms, scores] = extract.results(past_yes_terms + positive)
+        excluded = set(past_no_terms + negative)
+        if opt_count is None:
+            [ranked_terms, scores] = extract.results(past_yes_terms + positive)
+        else:
+            # Excluded terms are filtered out after ranking, so as many more
+            # terms are requested.
+            [ranked_terms, scores] = extract.topResults(past_yes_terms + positive, opt_offset + opt_count + len(excluded))
+
+        ranked_terms = [ term for term in ranked_terms if term not in excluded]
 
-        ranked_terms = [ term for term in ranked_terms if (term not in past_no_terms) and (term not in negative)]
+        if opt_count is not None:
+            ranked_terms = ranked_terms[opt_offset:opt_offset + opt_count]
                 
         return ranked_terms # ranked
 
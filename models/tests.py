@@ -0,0 +1,136 @@
+import unittest
+from datetime import datetime
+
+import crawlermodel
+from crawlermodel import CrawlerModel
+
+# Pages of a fake crawler index, {url: {'retrieved', 'tag'}}, retrieved being an epoch in seconds.
+PAGES = {}
+
+def retrieved_string(epoch):
+  return datetime.utcfromtimestamp(epoch).strftime('%Y-%m-%dT%H:%M:%S.%f')
+
+def fake_most_recent_documents(opt_maxNumberOfPages = 1000, fields = [], opt_filter = None,
+                               es_index = 'memex', es_doc_type = 'page', es = None,
+                               opt_retrievedFrom = None):
+  urls = sorted(PAGES.keys(), key = lambda url: -PAGES[url]['retrieved'])
+  if not opt_retrievedFrom is None:
+    urls = [url for url in urls if PAGES[url]['retrieved'] >= float(opt_retrievedFrom)]
+  hits = []
+  for url in urls[:opt_maxNumberOfPages]:
+    hit = {'url': [url], 'retrieved': [retrieved_string(PAGES[url]['retrieved'])]}
+    if PAGES[url].get('tag'):
+      hit['tag'] = [PAGES[url]['tag']]
+    hits.append(hit)
+  return hits
+
+# Returns the tags of the tagged pages among urls.
+def fake_get_documents(urls, term_field, fields = ['text'], es_index = 'memex', es_doc_type = 'page',
+                       es = None):
+  return {url: {'tag': PAGES[url]['tag']} for url in urls if PAGES.get(url, {}).get('tag')}
+
+def fake_update_document(entries, id_field = 'url', es_index = 'memex', es_doc_type = 'page',
+                         es = None):
+  for entry in entries:
+    PAGES.setdefault(entry[id_field], {'retrieved': 0}).update(entry)
+
+# Stands for the projection worker of the crawler, placing no page.
+class FakeWorker:
+  def lastPosition(self):
+    return 0
+
+  def getPositionsSince(self, lastPosition):
+    return None if lastPosition is None else []
+
+class GetPagesTest(unittest.TestCase):
+  def setUp(self):
+    PAGES.clear()
+    for i in range(5):
+      PAGES['http://%d' % i] = {'retrieved': 1000 + i}
+
+    self._saved = [crawlermodel.get_es, crawlermodel.get_most_recent_documents,
+                   crawlermodel.get_documents, crawlermodel.update_document]
+    crawlermodel.get_es = lambda: None
+    crawlermodel.get_most_recent_documents = fake_most_recent_documents
+    crawlermodel.get_documents = fake_get_documents
+    crawlermodel.update_document = fake_update_document
+
+    self.model = CrawlerModel()
+    self.model._activeCrawlerIndex = 'crawler'
+    self.model._projectionWorker = FakeWorker()
+    self.model.invalidateTermsSummary = lambda: None
+
+  def tearDown(self):
+    [crawlermodel.get_es, crawlermodel.get_most_recent_documents,
+     crawlermodel.get_documents, crawlermodel.update_document] = self._saved
+
+  def delta(self, previous):
+    return self.model.getPages(previous['last_downloaded_url_epoch'], previous['last_tag_edit'],
+                               previous['last_position'])
+
+  def test_all_pages(self):
+    pages = self.model.getPages()
+    self.assertFalse(pages['delta'])
+    self.assertEqual([page[0] for page in pages['pages']], ['http://%d' % i for i in range(4, -1, -1)])
+    self.assertEqual(pages['last_downloaded_url_epoch'], 1004)
+    self.assertEqual(pages['last_tag_edit'], 0)
+    self.assertEqual(pages['pages_cap'], 1000)
+
+  def test_new_pages_and_tags(self):
+    first = self.model.getPages()
+
+    PAGES['http://5'] = {'retrieved': 1005}
+    self.model.setPagesTag(['http://1', 'http://2'], 'Relevant', True)
+    self.model.setPagesTag(['http://1'], 'Deep', True)
+
+    pages = self.delta(first)
+    self.assertTrue(pages['delta'])
+    self.assertEqual([page[0] for page in pages['pages']], ['http://5', 'http://4'])
+    self.assertEqual(pages['tags'], [['http://1', ['Relevant']], ['http://2', ['Relevant']],
+                                     ['http://1', ['Relevant', 'Deep']]])
+    self.assertEqual(pages['last_downloaded_url_epoch'], 1005)
+    self.assertEqual(pages['last_tag_edit'], 3)
+    self.assertEqual(pages['pages_cap'], 1000)
+
+    self.model.setPagesTag(['http://2'], 'Relevant', False)
+    pages = self.delta(pages)
+    self.assertEqual(pages['tags'], [['http://2', ['']]])
+    self.assertEqual(self.delta(pages)['tags'], [])
+
+  def test_dropped_tag_edits(self):
+    self.model._tagEditsCap = 4
+    first = self.model.getPages()
+    for i in range(5):
+      self.model.setPagesTag(['http://%d' % i], 'Relevant', True)
+
+    # The first edits were dropped, the previous response can not be updated.
+    self.assertEqual(self.model._tagEditsDropped, 3)
+    self.assertEqual([url for url, _ in self.model._tagEdits], ['http://3', 'http://4'])
+    self.assertIsNone(self.model.getTagEditsSince(first['last_tag_edit']))
+    self.assertFalse(self.delta(first)['delta'])
+    self.assertEqual(self.model.getTagEditsSince(4), [['http://4', ['Relevant']]])
+
+  def test_reset_tag_edits(self):
+    first = self.model.getPages()
+    self.model.setPagesTag(['http://1'], 'Relevant', True)
+    self.model.resetTagEdits()
+
+    self.assertIsNone(self.model.getTagEditsSince(first['last_tag_edit']))
+    pages = self.delta(first)
+    self.assertFalse(pages['delta'])
+    self.assertEqual(self.delta(pages)['tags'], [])
+
+  def test_unknown_positions(self):
+    first = self.model.getPages()
+    first['last_position'] = None
+    self.assertFalse(self.delta(first)['delta'])
+
+  def test_many_new_pages(self):
+    self.model._pagesCap = 3
+    first = self.model.getPages()
+    for i in range(5, 8):
+      PAGES['http://%d' % i] = {'retrieved': 1000 + i}
+    self.assertFalse(self.delta(first)['delta'])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,5 +1,6 @@
 from math import sqrt
 from numpy import *
+from scipy.sparse import csr_matrix, diags
 
 import sys
 
@@ -10,25 +11,156 @@ sys.setdefaultencoding("utf-8")
 class BayesianSets:
     # D-> Query Set
     # X-> Data Set
+    #
+    # D and X are either dense arrays or scipy.sparse matrices (CSR is best
+    # suited for the product with X). Sparse input is never densified: only
+    # column sums and the product of X with the q vector are computed.
     def score(self, D, X) :
 
         #Compute Bayesian Sets Parameters
         c = 2
         N = D.shape[0]
-        T = concatenate((D,X))
-        m = divide(sum(T, axis=0),T.shape[0])
+        sum_D = column_sum(D)
+        m = divide(add(sum_D, column_sum(X)), N + X.shape[0])
 
         a = multiply(m, c)
         b = multiply(subtract(1,m),c)
         
-        at = add(a,sum(D, axis=0))
-        bt = subtract(add(b,N),sum(D, axis=0))
+        at = add(a,sum_D)
+        bt = subtract(add(b,N),sum_D)
 
         C = sum(subtract(add(subtract(log(add(a,b)),log(add(add(a,b),N))), log(bt)), log (b)))
 
         q = add(subtract(subtract(log(at),log(a)),log(bt)), log(b))
         
-        score_X = add(C, dot(X,q))
+        score_X = add(C, asarray(X.dot(q)).ravel())
         
         return score_X
-        
+
+# Scores rows of a fixed (normalised) data matrix against query sets of its
+# rows. The column sums of the whole matrix are computed once, and the prior
+# vectors m, a, b and their logs are kept while the rows of the query and data
+# sets together stay the same, e.g. while relevance feedback only moves rows
+# into the query set. Each query then only computes at, bt and q.
+class BayesianSetsScorer:
+    def __init__(self, data, c = 2):
+        self.data = csr_matrix(data)
+        self.c = c
+        self.column_sum = column_sum(self.data)
+        self._prior_key = None
+        self._prior = None
+
+    # Scores the data set rows (other_indices) against the query set rows
+    # (query_indices). Gives the same scores as BayesianSets.score on these
+    # rows, restricted to the columns present in the query set.
+    def score(self, query_indices, other_indices):
+        other_indices = asarray(other_indices, dtype=int)
+
+        [C, q] = self.query(query_indices, other_indices)
+
+        return add(C, asarray(self.data[other_indices, :].dot(q)).ravel())
+
+    # Returns the constant C and the vector q of the query set rows
+    # (query_indices), so that the scores of data rows are C + X.q.
+    def query(self, query_indices, other_indices):
+        query_indices = asarray(query_indices, dtype=int)
+        other_indices = asarray(other_indices, dtype=int)
+
+        [a, b, log_a, log_b, log_ab] = self.prior(query_indices, other_indices)
+
+        N = len(query_indices)
+        sum_D = column_sum(self.data[query_indices, :])
+
+        # Features not present in query set documents are left out
+        features = where(sum_D != 0)[0]
+        sum_D = sum_D[features]
+        a = a[features]
+        b = b[features]
+
+        at = add(a,sum_D)
+        bt = subtract(add(b,N),sum_D)
+
+        C = sum(subtract(add(subtract(log_ab[features],log(add(add(a,b),N))), log(bt)), log_b[features]))
+
+        q = zeros(self.data.shape[1])
+        q[features] = add(subtract(subtract(log(at),log_a[features]),log(bt)), log_b[features])
+
+        return [C, q]
+
+    # Returns the prior vectors a, b and the logs of a, b and a + b over the
+    # query and data set rows.
+    def prior(self, query_indices, other_indices):
+        excluded = ones(self.data.shape[0], dtype=bool)
+        excluded[query_indices] = False
+        excluded[other_indices] = False
+        excluded = where(excluded)[0]
+
+        key = tuple(excluded.tolist())
+        if key != self._prior_key:
+            n = self.data.shape[0] - len(excluded)
+            sum_T = self.column_sum
+            if len(excluded) > 0:
+                sum_T = subtract(sum_T, column_sum(self.data[excluded, :]))
+            m = divide(sum_T, n) if n > 0 else zeros(len(sum_T))
+
+            a = multiply(m, self.c)
+            b = multiply(subtract(1,m),self.c)
+            # Features absent from all rows are never scored
+            present = a > 0
+            log_a = zeros(len(a))
+            log_a[present] = log(a[present])
+
+            self._prior = [a, b, log_a, log(b), log(add(a,b))]
+            self._prior_key = key
+
+        return self._prior
+
+# Returns the constant C and the vector q of a query set D, whose columns are
+# normalised over a whole index of n_doc rows rather than over the data set:
+# every column of the index sums to 1, so that the prior mean m of all columns
+# is 1 / n_doc. The scores of rows X of the index are then C + X.q.
+def index_query(D, n_doc, c = 2):
+    N = D.shape[0]
+    sum_D = column_sum(D)
+    m = divide(1.0, n_doc)
+
+    a = multiply(m, c)
+    b = multiply(subtract(1,m),c)
+
+    at = add(a,sum_D)
+    bt = subtract(add(b,N),sum_D)
+
+    C = sum(subtract(add(subtract(log(add(a,b)),log(add(add(a,b),N))), log(bt)), log (b)))
+
+    q = add(subtract(subtract(log(at),log(a)),log(bt)), log(b))
+
+    return [C, q]
+
+# Returns the sums of the columns of a dense or sparse matrix as a 1-D array.
+def column_sum(M):
+    return asarray(M.sum(axis=0)).ravel()
+
+# Divides the columns of a dense or sparse matrix by their sums, leaving all
+# zero columns as they are. Returns a CSR matrix.
+def normalize_columns(M):
+    col_sum = column_sum(M)
+    inv_col_sum = zeros(len(col_sum))
+    non_zero = col_sum != 0
+    inv_col_sum[non_zero] = divide(1.0, col_sum[non_zero])
+    return csr_matrix(M).dot(diags(inv_col_sum, 0)).tocsr()
+
+# Returns the indices of the scores ranked from offset to offset + count in
+# decreasing order. Only those are sorted: the others are discarded with a
+# partial selection.
+def top_indices(score, count, offset=0):
+    score = asarray(score)
+    end = offset + count if offset + count < len(score) else len(score)
+    if offset >= end:
+        return array([], dtype=int)
+
+    if end < len(score):
+        candidates = argpartition(multiply(score,-1), end - 1)[:end]
+    else:
+        candidates = arange(len(score))
+
+    return candidates[argsort(multiply(score[candidates],-1))][offset:end]
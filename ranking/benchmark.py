@@ -0,0 +1,268 @@
+#!/usr/bin/env python
+import sys
+import json
+import time
+import resource
+import platform
+import argparse
+import numpy as np
+import scipy
+from datetime import datetime
+from multiprocessing import Pool
+from scipy.sparse import csr_matrix
+
+import tfidf
+import rank
+import extract_terms
+import BayesianSets
+
+# Micro benchmarks of the ranking code on synthetic corpora, run offline: the
+# term statistics of the documents are generated instead of being fetched from
+# Elasticsearch.
+#
+#   python ranking/benchmark.py --sizes 1000,10000 --output bench.json
+#   python ranking/benchmark.py --compare bench.json
+#
+# Each benchmark runs in a process of its own, and reports its wall time (the
+# first call, with the caches of the model cold), the median time of the
+# repeated calls, and the peak resident memory used by the calls beyond that of
+# the process before them (on Linux only, where the peak can be reset once the
+# corpus is built: None elsewhere). Results are saved as JSON. With --compare,
+# the median times are compared to those of a previous run, and the exit status
+# is 1 if any benchmark got slower than --tolerance times its previous time.
+
+BENCHMARKS = ['tfidf', 'rank.results', 'rank.topResults', 'extract_terms.results',
+              'getTopTerms', 'BayesianSets.score']
+
+# Term statistics of a synthetic corpus of n_docs documents. Documents draw
+# terms_per_doc terms (with repetitions, giving the term frequencies) from a
+# vocabulary with Zipfian frequencies of exponent zipf, whose size grows with
+# the corpus as by Heaps' law.
+class synthetic_corpus:
+    def __init__(self, n_docs, terms_per_doc = 50, zipf = 1.1, seed = 0):
+        state = np.random.RandomState(seed)
+        n_terms = max(1000, int(50 * n_docs ** 0.6))
+
+        weights = np.power(np.arange(1, n_terms + 1, dtype=np.float64), -zipf)
+        cdf = np.cumsum(weights)
+        cdf /= cdf[-1]
+
+        lengths = state.poisson(terms_per_doc, n_docs) + 1
+        rows = np.repeat(np.arange(n_docs, dtype=np.int64), lengths)
+        terms = np.minimum(np.searchsorted(cdf, state.random_sample(len(rows))), n_terms - 1)
+
+        # Counts the occurrences of each term per document, which also sorts the
+        # terms of each document.
+        [keys, tf] = np.unique(rows * n_terms + terms, return_counts=True)
+        rows = keys // n_terms
+        indices = (keys % n_terms).astype(np.int32)
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(rows, minlength=n_docs)))).astype(np.int32)
+
+        df = np.bincount(indices, minlength=n_terms)
+        idf = np.log(np.divide(float(n_docs), np.maximum(df, 1)))
+        tf = tf.astype(np.float64)
+
+        self.documents = ['http://example.com/%d' % i for i in xrange(n_docs)]
+        # Zero padded, so that sorting the terms keeps the columns in order
+        self.corpus = ['w%07d' % i for i in xrange(n_terms)]
+        self.tf = csr_matrix((tf, indices, indptr), shape=(n_docs, n_terms))
+        self.tfidf = csr_matrix((tf * idf[indices], indices, indptr), shape=(n_docs, n_terms))
+        self.ttf = np.bincount(indices, weights=tf, minlength=n_terms)
+        self._doc_index = {doc: i for i, doc in enumerate(self.documents)}
+
+    # Same results as elastic.get_mtermvectors.getTermStatistics, for the
+    # documents of the corpus.
+    def getTermStatistics(self, all_hits, es_index = 'memex', es_doc_type = 'page', es = None):
+        rows = np.array([self._doc_index[doc] for doc in all_hits if doc in self._doc_index], dtype=np.int64)
+        data_tfidf = self.tfidf[rows]
+        data_tf = self.tf[rows]
+
+        columns = np.unique(data_tf.indices)
+        corpus = [self.corpus[i] for i in columns]
+        ttf = dict(zip(corpus, self.ttf[columns].tolist()))
+
+        return [data_tfidf[:, columns], data_tf[:, columns], ttf, corpus,
+                [self.documents[i] for i in rows]]
+
+# Returns the peak resident memory of the process in MB.
+def peak_rss_mb():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kB, OS X bytes
+    return maxrss / (1024.0 * 1024.0) if sys.platform == 'darwin' else maxrss / 1024.0
+
+# Resets the peak resident memory of the process (VmHWM) to its current
+# resident memory. Returns False where this is not supported (Linux before 4.0,
+# other systems).
+def reset_peak_rss():
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return status_mb('VmHWM') is not None
+    except IOError:
+        return False
+
+# Returns a memory field of /proc/self/status (e.g. VmRSS, VmHWM) in MB, or
+# None.
+def status_mb(field):
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024.0
+    except IOError:
+        pass
+    return None
+
+# Returns the time of calling func once, and the median time of repeat more
+# calls.
+def time_calls(func, repeat):
+    start = time.time()
+    func()
+    first = time.time() - start
+
+    times = []
+    for _ in xrange(repeat):
+        start = time.time()
+        func()
+        times.append(time.time() - start)
+
+    return [first, float(np.median(times)) if len(times) > 0 else first]
+
+# Prepares the call of a benchmark on corpus.
+def setup(name, corpus, query_count):
+    tfidf.getTermStatistics = corpus.getTermStatistics
+    state = np.random.RandomState(1)
+
+    if name == 'tfidf':
+        return lambda: tfidf.tfidf(corpus.documents)
+
+    table = tfidf.tfidf(corpus.documents)
+    query = [corpus.documents[i] for i in state.choice(len(corpus.documents), query_count, replace=False)]
+    query_set = set(query)
+    others = [doc for doc in corpus.documents if not doc in query_set]
+
+    if name == 'rank.results':
+        return lambda: rank.rank().results(table, query, others)
+    if name == 'rank.topResults':
+        return lambda: rank.rank().topResults(table, query, others, 100)
+    if name == 'getTopTerms':
+        return lambda: table.getTopTerms(100)
+    if name == 'extract_terms.results':
+        terms = table.getTopTerms(query_count)
+        return lambda: extract_terms.extract_terms(table).results(terms)
+    if name == 'BayesianSets.score':
+        data = BayesianSets.normalize_columns(table.tfidfArray)
+        mask = np.zeros(data.shape[0], dtype=bool)
+        mask[table.getTfidfMatrix().getRowIndices(query)] = True
+        D = data[np.where(mask)[0]]
+        X = data[np.where(~mask)[0]]
+        return lambda: BayesianSets.BayesianSets().score(D, X)
+
+    raise ValueError('Unknown benchmark ' + name)
+
+def run_benchmark(args):
+    [name, n_docs, options] = args
+
+    corpus = synthetic_corpus(n_docs, options['terms_per_doc'], options['zipf'], options['seed'])
+    func = setup(name, corpus, options['query_count'])
+
+    # The peak memory of building the corpus is left out.
+    increase = None
+    if reset_peak_rss():
+        baseline = status_mb('VmRSS')
+        [first, warm] = time_calls(func, options['repeat'])
+        increase = status_mb('VmHWM') - baseline
+    else:
+        [first, warm] = time_calls(func, options['repeat'])
+
+    return {
+        'benchmark': name,
+        'n_docs': n_docs,
+        'n_terms': corpus.tf.shape[1],
+        'nnz': corpus.tf.nnz,
+        'wall_time_s': first,
+        'warm_time_s': warm,
+        'peak_rss_mb': peak_rss_mb(),
+        'peak_rss_increase_mb': increase
+    }
+
+# Returns the benchmarks slower than tolerance times their previous time. The
+# median times of the repeated calls are compared, single cold calls vary too
+# much.
+def compare(results, previous, tolerance):
+    previous_times = {(res['benchmark'], res['n_docs']): res['warm_time_s'] for res in previous['results']}
+    regressions = []
+    for res in results:
+        before = previous_times.get((res['benchmark'], res['n_docs']))
+        if before is None or before <= 0:
+            continue
+        ratio = res['warm_time_s'] / before
+        print "%-24s %9d docs  %8.3fs -> %8.3fs  x%.2f" % (res['benchmark'], res['n_docs'], before, res['warm_time_s'], ratio)
+        if ratio > tolerance:
+            regressions.append(res)
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Ranking micro benchmarks on synthetic corpora.')
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000',
+                        help='comma separated numbers of documents')
+    parser.add_argument('--benchmarks', default=','.join(BENCHMARKS),
+                        help='comma separated benchmarks among ' + ', '.join(BENCHMARKS))
+    parser.add_argument('--terms-per-doc', type=int, default=50)
+    parser.add_argument('--zipf', type=float, default=1.1)
+    parser.add_argument('--query-count', type=int, default=10,
+                        help='number of query documents (and terms)')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='ranking_benchmark.json')
+    parser.add_argument('--compare', default=None, help='JSON results of a previous run')
+    parser.add_argument('--tolerance', type=float, default=1.2)
+    args = parser.parse_args(argv)
+
+    options = {
+        'terms_per_doc': args.terms_per_doc,
+        'zipf': args.zipf,
+        'query_count': args.query_count,
+        'repeat': args.repeat,
+        'seed': args.seed
+    }
+
+    results = []
+    for n_docs in [int(size) for size in args.sizes.split(',')]:
+        for name in args.benchmarks.split(','):
+            # A fresh process per benchmark, so that peak memory is its own
+            pool = Pool(1, maxtasksperchild=1)
+            try:
+                res = pool.apply(run_benchmark, [[name, n_docs, options]])
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+            memory = res['peak_rss_increase_mb']
+            print "%-24s %9d docs  %8.3fs  (warm %8.3fs)  %s" % \
+                (name, n_docs, res['wall_time_s'], res['warm_time_s'],
+                 "%8.1f MB" % memory if memory is not None else "       ? MB")
+            results.append(res)
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'created': datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'scipy': scipy.__version__,
+            'options': options,
+            'results': results
+        }, f, indent=2)
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        regressions = compare(results, previous, args.tolerance)
+        if len(regressions) > 0:
+            print len(regressions), "benchmarks slower than", args.tolerance, "times their previous median time"
+            return 1
+
+    return 0
+
+if __name__=="__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -12,46 +12,44 @@ class extract_terms:
         return self.table.getTopTerms(top)
         
     def results(self,query_terms):
-        
-        [_, _, d] = self.table.getTfidfArray()
 
-        query_index = self.table.getIndex(query_terms)
+        [other_terms, score] = self.scores(query_terms)
 
-        #Normalise the data
-        col_sum_d = np.sum(d,axis=0)    
-        norm_d = np.divide(d, col_sum_d)
+        rank_index = np.argsort(np.multiply(score,-1))
 
-        data = np.transpose(norm_d)
+        # Get the terms corresponding to the scored indices
+        ranked_terms = [other_terms[i] for i in rank_index]
 
-        # documents other than the relevant documents
-        index = [x for x in range(0,len(data)) if x not in query_index]
+        ranked_scores = [score[i] for i in rank_index]
+        return [ranked_terms,ranked_scores]
 
-        subquery_data = data[query_index,:]
-        other_data = data[index,:]
+    # Returns count ranked terms and their scores, starting from rank offset.
+    def topResults(self,query_terms, count, opt_offset = 0):
 
-        # Check if any of the features are not present in any 
-        # of the query set documents
-        check_for_zero = np.sum(subquery_data, axis=0)
-        zero_indices = np.where(check_for_zero == 0)[0]
-        
-        if(len(zero_indices) > 0):
-            # If features not present in query set documents
-            # then remove them
-            subquery_data = np.delete(subquery_data, zero_indices, 1)
-            other_data  = np.delete(other_data, zero_indices, 1)
+        [other_terms, score] = self.scores(query_terms)
 
-        bs = BayesianSets.BayesianSets()
-        score = bs.score(subquery_data, other_data)
+        rank_index = BayesianSets.top_indices(score, count, opt_offset)
 
-        rank_index = np.argsort(np.multiply(score,-1))
+        ranked_terms = [other_terms[i] for i in rank_index]
 
-        offset_rank_index = [index[x] for x in rank_index]
+        ranked_scores = [score[i] for i in rank_index]
+        return [ranked_terms,ranked_scores]
 
-        # Get the terms corresponding to the scored indices
-        ranked_terms = self.table.getTerms(offset_rank_index)
+    # Returns the terms other than query_terms and their scores.
+    def scores(self,query_terms):
+        
+        data = self.table.getTfidfMatrix()
 
-        ranked_scores = [score[rank_index[i]] for i in range(0, len(score))]
-        return [ranked_terms,ranked_scores]
+        query_mask = data.getColumnMask([term.strip() for term in query_terms])
+        other_index = np.where(~query_mask)[0]
+
+        # The scorer holds the normalised data, with terms as rows
+        scorer = self.table.getScorer(True)
+        score = scorer.score(np.where(query_mask)[0], other_index)
+
+        other_terms = [data.columns[i] for i in other_index]
+
+        return [other_terms, score]
 
 def main(argv):
     if len(argv) != 2:
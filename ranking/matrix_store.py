@@ -0,0 +1,123 @@
+import sys
+import json
+import time
+import shutil
+import numpy as np
+from os import environ, fdopen, listdir, makedirs, rename
+from os.path import exists, isdir, join
+from tempfile import gettempdir, mkdtemp, mkstemp
+
+__export__ = ['matrix_store']
+
+# Persistent store of the tf-idf models of domain indices (see tfidf.save and
+# tfidf.load), with a directory per index:
+#
+#   <store_dir>/<index>/CURRENT      name of the current snapshot
+#   <store_dir>/<index>/<snapshot>/  indptr.npy, indices.npy, tfidf.npy, tf.npy,
+#                                    df.npy, ttf.npy, documents.json, corpus.json
+#
+# The arrays of a snapshot are opened read only with numpy.memmap, so that all
+# processes loading it share the same pages of the file system cache, and
+# loading costs opening the files and reading the url and term tables.
+#
+# Snapshots are never modified: saving writes a new snapshot and then switches
+# CURRENT to it, processes which loaded an older one keep using it. The last
+# keep snapshots of an index are kept.
+class matrix_store:
+    ARRAYS = ['indptr', 'indices', 'tfidf', 'tf', 'df', 'ttf']
+
+    def __init__(self, store_dir = None, keep = 2):
+        if store_dir is None:
+            store_dir = environ.get('DDT_MATRIX_STORE', join(gettempdir(), 'ddt_matrices'))
+        self.store_dir = store_dir
+        self.keep = keep
+
+    # Saves a snapshot of the model of es_index and makes it the current one.
+    # arrays is a dictionary with the ARRAYS of the model. Returns the name of
+    # the snapshot.
+    def save(self, es_index, arrays, documents, corpus):
+        index_dir = join(self.store_dir, es_index)
+        if not exists(index_dir):
+            makedirs(index_dir)
+
+        tmp_dir = mkdtemp(prefix='.tmp', dir=index_dir)
+        for name in matrix_store.ARRAYS:
+            np.save(join(tmp_dir, name + '.npy'), np.ascontiguousarray(arrays[name]))
+        with open(join(tmp_dir, 'documents.json'), 'w') as f:
+            json.dump(documents, f)
+        with open(join(tmp_dir, 'corpus.json'), 'w') as f:
+            json.dump(corpus, f)
+
+        snapshot = '%d' % int(time.time() * 1000)
+        while exists(join(index_dir, snapshot)):
+            snapshot = '%d' % (int(snapshot) + 1)
+        rename(tmp_dir, join(index_dir, snapshot))
+
+        # Each save writes its own temporary file, so that concurrent saves
+        # of the index do not overwrite each other's before renaming it.
+        [fd, tmp_current] = mkstemp(prefix='.CURRENT', dir=index_dir)
+        with fdopen(fd, 'w') as f:
+            f.write(snapshot)
+        rename(tmp_current, join(index_dir, 'CURRENT'))
+
+        for old in self.snapshots(es_index)[:-self.keep]:
+            shutil.rmtree(join(index_dir, old), ignore_errors=True)
+
+        return snapshot
+
+    # Returns the current snapshot of es_index as [arrays, documents, corpus],
+    # arrays being read only memmaps, or None if there is none.
+    def load(self, es_index):
+        snapshot = self.current(es_index)
+        if snapshot is None:
+            return None
+
+        snapshot_dir = join(self.store_dir, es_index, snapshot)
+        arrays = {name: np.load(join(snapshot_dir, name + '.npy'), mmap_mode='r')
+                  for name in matrix_store.ARRAYS}
+        with open(join(snapshot_dir, 'documents.json')) as f:
+            documents = json.load(f)
+        with open(join(snapshot_dir, 'corpus.json')) as f:
+            corpus = json.load(f)
+
+        return [arrays, documents, corpus]
+
+    # Returns the name of the current snapshot of es_index, or None.
+    def current(self, es_index):
+        try:
+            with open(join(self.store_dir, es_index, 'CURRENT')) as f:
+                return f.read().strip()
+        except IOError:
+            return None
+
+    # Returns the names of the snapshots of es_index, oldest first.
+    def snapshots(self, es_index):
+        index_dir = join(self.store_dir, es_index)
+        if not exists(index_dir):
+            return []
+        return sorted([name for name in listdir(index_dir)
+                       if name.isdigit() and isdir(join(index_dir, name))], key=int)
+
+# Builds the model of all the documents of an index and saves it in the
+# default store:
+#
+#   python matrix_store.py memex page
+def main(argv):
+    if len(argv) < 1:
+        print "Invalid arguments"
+        print "python matrix_store.py es_index [es_doc_type]"
+        return
+
+    from elastic.connections import get_es_client
+    from elastic.generators import ids_generator
+    from tfidf import tfidf
+
+    es_index = argv[0]
+    es_doc_type = argv[1] if len(argv) > 1 else 'page'
+
+    ids = list(ids_generator(get_es_client(), es_index, es_doc_type))
+    table = tfidf(ids, es_index, es_doc_type)
+    print table.save(), len(table.documents), "documents", len(table.corpus), "terms"
+
+if __name__=="__main__":
+    main(sys.argv[1:])
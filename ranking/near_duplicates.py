@@ -0,0 +1,155 @@
+import zlib
+import numpy as np
+from scipy.sparse import csr_matrix
+
+# Mersenne prime 2^31 - 1: hashed values stay below it, so that products of
+# two of them fit in 64 bits.
+_PRIME = (1 << 31) - 1
+
+# Groups near duplicate documents (mirrors, syndicated copies, urls differing
+# by a session id, ...) with MinHash signatures of their sets of terms and an
+# LSH index over these signatures.
+#
+# The signature of a document holds, for each of num_perm hash functions, the
+# minimum hash of its terms. Two documents agree on a hash function with a
+# probability equal to the Jaccard similarity of their sets of terms.
+# Signatures are split into bands, and documents sharing a band are candidate
+# duplicates: a document is a duplicate of a candidate when their signatures
+# agree on at least threshold of the hash functions.
+#
+# Each group of duplicates has a representative, the first document of the
+# group added to the index.
+class near_duplicates:
+    def __init__(self, num_perm = 64, bands = 16, threshold = 0.8, seed = 1):
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+
+        state = np.random.RandomState(seed)
+        self._a = state.randint(1, _PRIME, num_perm).astype(np.int64)
+        self._b = state.randint(0, _PRIME, num_perm).astype(np.int64)
+
+        self._signatures = {}
+        self._buckets = {}
+        self._representative = {}
+        self._members = {}
+
+    def __contains__(self, label):
+        return label in self._representative
+
+    def __len__(self):
+        return len(self._representative)
+
+    # Adds the documents labels, whose terms are the non zero columns of the
+    # rows of matrix (dense or sparse), labelled by columns.
+    def add(self, labels, matrix, columns):
+        signatures = self.signatures(matrix, columns)
+
+        for label, signature in zip(labels, signatures):
+            if label in self._representative:
+                continue
+
+            representative = label
+            if signature[0] < _PRIME:
+                keys = self._band_keys(signature)
+                duplicate = self._find_duplicate(signature, keys)
+                if duplicate is not None:
+                    representative = self._representative[duplicate]
+                for key in keys:
+                    self._buckets.setdefault(key, []).append(label)
+                self._signatures[label] = signature
+
+            self._representative[label] = representative
+            self._members.setdefault(representative, []).append(label)
+
+    # Removes the documents labels. The next document of a group whose
+    # representative is removed becomes its representative.
+    def remove(self, labels):
+        for label in set(labels):
+            representative = self._representative.pop(label, None)
+            if representative is None:
+                continue
+
+            signature = self._signatures.pop(label, None)
+            if signature is not None:
+                for key in self._band_keys(signature):
+                    bucket = self._buckets[key]
+                    bucket.remove(label)
+                    if len(bucket) == 0:
+                        del self._buckets[key]
+
+            members = self._members.pop(representative)
+            members.remove(label)
+            if len(members) > 0:
+                if representative == label:
+                    representative = members[0]
+                    for member in members:
+                        self._representative[member] = representative
+                self._members[representative] = members
+
+    # Returns the representative of each of labels (labels not in the index are
+    # their own representative).
+    def getRepresentatives(self, labels):
+        return [self._representative.get(label, label) for label in labels]
+
+    # Returns the documents in the groups of labels, other than labels.
+    def getDuplicates(self, labels):
+        labels = set(labels)
+        representatives = set(self.getRepresentatives(labels))
+        return [member for representative in representatives
+                for member in self._members.get(representative, [])
+                if member not in labels]
+
+    # Returns labels without near duplicates of labels before them or of
+    # opt_exclude.
+    def collapse(self, labels, opt_exclude = []):
+        seen = set(self.getRepresentatives(opt_exclude))
+        collapsed = []
+        for label, representative in zip(labels, self.getRepresentatives(labels)):
+            if not representative in seen:
+                seen.add(representative)
+                collapsed.append(label)
+        return collapsed
+
+    # Returns the MinHash signatures of the rows of matrix. Rows without terms
+    # have signatures of _PRIME, which match no other row.
+    def signatures(self, matrix, columns):
+        matrix = csr_matrix(matrix, copy=True)
+        matrix.eliminate_zeros()
+
+        hashes = np.array([zlib.crc32(term.encode('utf-8')) & 0x7fffffff for term in columns],
+                          dtype=np.int64)
+        values = hashes[matrix.indices]
+
+        signatures = np.empty((matrix.shape[0], self.num_perm), dtype=np.int64)
+        signatures.fill(_PRIME)
+
+        non_empty = np.where(np.diff(matrix.indptr) > 0)[0]
+        if len(non_empty) > 0:
+            starts = matrix.indptr[non_empty]
+            for i in xrange(self.num_perm):
+                hashed = np.mod(np.add(np.multiply(values, self._a[i]), self._b[i]), _PRIME)
+                signatures[non_empty, i] = np.minimum.reduceat(hashed, starts)
+
+        return signatures
+
+    def _band_keys(self, signature):
+        return [(band, tuple(signature[band * self.rows:(band + 1) * self.rows].tolist()))
+                for band in xrange(self.bands)]
+
+    # Returns the most similar indexed document sharing a band with signature,
+    # if similar enough.
+    def _find_duplicate(self, signature, keys):
+        candidates = set()
+        for key in keys:
+            candidates.update(self._buckets.get(key, []))
+
+        duplicate = None
+        best = self.threshold
+        for candidate in candidates:
+            similarity = np.mean(self._signatures[candidate] == signature)
+            if similarity >= best:
+                duplicate = candidate
+                best = similarity
+        return duplicate
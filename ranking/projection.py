@@ -0,0 +1,79 @@
+import numpy as np
+from scipy.sparse import csr_matrix, issparse
+
+__export__ = ['pca_project', 'pca_fit', 'pca_transform']
+
+# Projects the rows of X (dense or sparse, e.g. a tf-idf matrix) on their
+# first n_components principal components. Returns, as sklearn PCA would:
+#   [explained_variance_ratio, projection]
+#
+# Sparse input is never densified: X is centered implicitly in the products
+# with it, and only n_components (plus n_oversamples) singular vectors are
+# computed with a randomized SVD (Halko, Martinsson & Tropp), refined by n_iter
+# power iterations. The cost is a few products of X with thin matrices, in
+# proportion to its non zero entries.
+#
+# With opt_float32, computations are done in single precision, which halves the
+# memory used and is enough to place points on screen.
+def pca_project(X, n_components = 2, opt_float32 = False, n_oversamples = 10, n_iter = 4, seed = 0):
+    [mean, components, ratio] = pca_fit(X, n_components, opt_float32, n_oversamples, n_iter, seed)
+    return [ratio.tolist(), pca_transform(X, mean, components).tolist()]
+
+# Returns the basis of the projection computed by pca_project:
+#   [mean, components, explained_variance_ratio]
+# where mean is the mean row of X and components the n_components x columns
+# matrix of the principal axes. Rows can then be placed in this basis with
+# pca_transform, without fitting it again.
+def pca_fit(X, n_components = 2, opt_float32 = False, n_oversamples = 10, n_iter = 4, seed = 0):
+    dtype = np.float32 if opt_float32 else np.float64
+    X = csr_matrix(X, dtype=dtype) if issparse(X) else np.asarray(X, dtype=dtype)
+    [n, d] = X.shape
+
+    components = np.zeros((n_components, d), dtype=dtype)
+    ratio = np.zeros(n_components)
+    rank = min(n_components, n - 1, d)
+    if rank < 1:
+        mean = np.asarray(X.mean(axis=0), dtype=dtype).ravel() if n > 0 else np.zeros(d, dtype=dtype)
+        return [mean, components, ratio]
+
+    mean = np.asarray(X.mean(axis=0), dtype=dtype).ravel()
+
+    # Products of the centered X, and of its transpose, with a thin matrix
+    def dot(A):
+        return np.asarray(X.dot(A)) - np.outer(np.ones(n, dtype=dtype), mean.dot(A))
+
+    def dot_transpose(B):
+        return np.asarray(X.T.dot(B)) - np.outer(mean, B.sum(axis=0))
+
+    k = min(rank + n_oversamples, n, d)
+    state = np.random.RandomState(seed)
+    Q = np.linalg.qr(dot(state.normal(size=(d, k)).astype(dtype)))[0]
+    for _ in xrange(n_iter):
+        Q = np.linalg.qr(dot_transpose(Q))[0]
+        Q = np.linalg.qr(dot(Q))[0]
+
+    [_, s, Vt] = np.linalg.svd(dot_transpose(Q).T, full_matrices=False)
+    s = s[:rank]
+    Vt = Vt[:rank]
+
+    # Signs of components are fixed by their largest loading, so that the
+    # projection does not flip from one call to the next.
+    signs = np.sign(Vt[np.arange(rank), np.argmax(np.abs(Vt), axis=1)])
+    signs[signs == 0] = 1
+    components[:rank] = Vt * signs[:, np.newaxis]
+
+    if issparse(X):
+        square_sum = np.asarray(X.multiply(X).sum(axis=0)).ravel()
+    else:
+        square_sum = np.square(X).sum(axis=0)
+    total_variance = np.sum(square_sum - n * np.square(mean.astype(np.float64)))
+    if total_variance > 0:
+        ratio[:rank] = np.square(s.astype(np.float64)) / total_variance
+
+    return [mean, components, ratio]
+
+# Projects the rows of X (dense or sparse, over the same columns as the rows
+# the basis was fitted on) on the components of a basis computed by pca_fit.
+def pca_transform(X, mean, components):
+    X = csr_matrix(X, dtype=components.dtype) if issparse(X) else np.asarray(X, dtype=components.dtype)
+    return np.asarray(X.dot(components.T)) - mean.dot(components.T)
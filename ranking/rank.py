@@ -3,44 +3,103 @@ import sys
 import tfidf
 import BayesianSets
 import numpy as np
+from scipy.sparse import diags
+from elastic.get_mtermvectors import getIndexTermStatistics
+from elastic.search_documents import weighted_terms_search
 
 class rank:
     def results(self,table,query_urls, other_urls):
 
-        [urls, corpus, data] = table.getTfidfArray()
+        [other_urls, score] = self.scores(table, query_urls, other_urls)
 
-        #Normalise the data
-        col_sum_d = np.sum(data,axis=0)    
-        norm_d = np.divide(data, col_sum_d)
+        indices = np.argsort(np.multiply(score,-1))
+        ranked_urls = [other_urls[index] for index in indices]
+        ranked_scores = [score[index] for index in indices]
+        return [ranked_urls,ranked_scores]
+
+    # Returns count ranked urls and their scores, starting from rank offset.
+    # If opt_processes is given, the other urls are scored in shards on that
+    # many processes (see sharded_scorer).
+    def topResults(self,table,query_urls, other_urls, count, opt_offset = 0, opt_processes = None):
+
+        if opt_processes is not None:
+            return self.shardedTopResults(table, query_urls, other_urls, count, opt_offset, opt_processes)
+
+        [other_urls, score] = self.scores(table, query_urls, other_urls)
 
-        indices = [urls.index(url) for url in query_urls]
-        subquery_data = norm_d[indices, :]
+        indices = BayesianSets.top_indices(score, count, opt_offset)
+        ranked_urls = [other_urls[index] for index in indices]
+        ranked_scores = [score[index] for index in indices]
+        return [ranked_urls,ranked_scores]
 
-        indices = [urls.index(url) for url in other_urls]
-        other_data = norm_d[indices, :]
+    def shardedTopResults(self,table,query_urls, other_urls, count, opt_offset = 0, opt_processes = None):
 
-        # Check if any of the features are not present in any 
-        # of the query set documents
-        check_for_zero = np.sum(subquery_data, axis=0)
-        zero_indices = np.where(check_for_zero == 0)[0]
+        [query_indices, other_urls, other_indices] = self.rows(table, query_urls, other_urls)
 
-        if(len(zero_indices) > 0):
-            # If features not present in query set documents
-            # then remove them
-            old_corpus = corpus
-            corpus = []
-            [corpus.append(old_corpus[i]) for i in range(0,len(old_corpus)) if i not in zero_indices]
+        scorer = table.getShardedScorer(False, opt_processes)
+        [positions, scores] = scorer.topScores(query_indices, other_indices, count, opt_offset)
 
-            subquery_data = np.delete(subquery_data, zero_indices, 1)
-            other_data = np.delete(other_data, zero_indices, 1)
+        ranked_urls = [other_urls[index] for index in positions]
+        ranked_scores = [score for score in scores]
+        return [ranked_urls,ranked_scores]
 
-        bs = BayesianSets.BayesianSets()
-        
-        score = bs.score(subquery_data, other_data)
+    # Returns the other urls found in table and their scores.
+    def scores(self,table,query_urls, other_urls):
 
-        indices = np.argsort(np.multiply(score,-1))
-        ranked_urls = [other_urls[index] for index in indices]
-        ranked_scores = [score[index] for index in indices]
+        [query_indices, other_urls, other_indices] = self.rows(table, query_urls, other_urls)
+
+        # The scorer holds the normalised data
+        scorer = table.getScorer()
+        score = scorer.score(query_indices, other_indices)
+
+        return [other_urls, score]
+
+    # Returns the rows of the query urls in table, and the other urls found in
+    # table with their rows.
+    def rows(self,table,query_urls, other_urls):
+
+        data = table.getTfidfMatrix()
+
+        # Near duplicates left out of the table stand for their representative
+        query_urls = table.getRepresentatives(query_urls)
+        query_set = set(query_urls)
+
+        # Urls without term vectors are not in the table
+        query_indices = data.getRowIndices(query_urls)
+        other_urls = [url for url in other_urls if url in data.row_index and not url in query_set]
+        other_indices = data.getRowIndices(other_urls)
+
+        return [query_indices, other_urls, other_indices]
+
+    # Ranks the documents of the whole index against query_urls inside
+    # Elasticsearch, so that only the term vectors of query_urls are fetched.
+    #
+    # The tf-idf columns normalised over the index are tf / ttf (idf cancels
+    # out), whose sums are known from the term statistics of the index, and so
+    # is the q vector of the query set. The score C + X.q of a document is
+    # approximated by giving each term present in the document its expected
+    # value 1 / df, i.e. by summing the weights q / df of the terms it holds.
+    # The opt_max_terms terms with the highest weights make the query.
+    #
+    # Returns count ranked urls, other than query_urls and opt_exclude_urls,
+    # and their scores, starting from rank opt_offset.
+    def indexResults(self, query_urls, count, opt_offset = 0, opt_exclude_urls = [], opt_max_terms = 100, es_index = 'memex', es_doc_type = 'page'):
+
+        [data_tf, corpus, df, ttf, n_doc, docs] = getIndexTermStatistics(list(query_urls), es_index, es_doc_type)
+        if len(corpus) == 0:
+            return [[], []]
+
+        D = data_tf.dot(diags(np.divide(1.0, ttf), 0))
+        [C, q] = BayesianSets.index_query(D, n_doc)
+
+        weights = np.divide(q, df)
+        top = BayesianSets.top_indices(weights, opt_max_terms)
+        weights = {corpus[i]: float(weights[i]) for i in top if weights[i] > 0}
+
+        exclude_urls = list(query_urls) + list(opt_exclude_urls)
+        [ranked_urls, scores] = weighted_terms_search('text', weights, exclude_urls, count, opt_offset, es_index, es_doc_type)
+
+        ranked_scores = [C + score for score in scores]
         return [ranked_urls,ranked_scores]
 
 def main(argv):
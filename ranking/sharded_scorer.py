@@ -0,0 +1,101 @@
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from multiprocessing.sharedctypes import RawArray
+from scipy.sparse import csr_matrix
+
+import BayesianSets
+
+# Scores the rows of a BayesianSetsScorer on a pool of processes. The CSR
+# arrays of the scorer data are copied once into shared memory, and the pool is
+# started once, with workers mapping these arrays without copying. For each
+# query, the parent computes the query vector q (which only needs the query
+# rows), the data rows to score are split into shards, each worker scores its
+# shards and keeps their top results, and the parent merges these into the
+# overall top results:
+#
+#   sharded = ShardedScorer(table.getScorer())
+#   [indices, scores] = sharded.topScores(query_indices, other_indices, 100)
+#
+# Worth it for data sets of hundreds of thousands of rows and more, below that
+# the cost of starting the processes dominates. The pool is stopped by close.
+class ShardedScorer:
+    def __init__(self, scorer, opt_processes = None, opt_shard_size = 50000):
+        self.scorer = scorer
+        self.processes = opt_processes if opt_processes is not None else cpu_count()
+        self.shard_size = opt_shard_size
+
+        data = scorer.data
+        self.shape = data.shape
+        self._data = _share(data.data)
+        self._indices = _share(data.indices)
+        self._indptr = _share(data.indptr)
+        self._pool = None
+
+    # Returns the positions in other_indices of the data rows ranked from
+    # offset to offset + count, and their scores.
+    def topScores(self, query_indices, other_indices, count, opt_offset = 0):
+        other_indices = np.asarray(other_indices, dtype=np.int64)
+        end = opt_offset + count
+        if len(other_indices) == 0 or count <= 0:
+            return [np.array([], dtype=int), np.array([])]
+
+        [C, q] = self.scorer.query(query_indices, other_indices)
+
+        shards = [(other_indices[start:start + self.shard_size], start, end, C, q)
+                  for start in xrange(0, len(other_indices), self.shard_size)]
+
+        if len(shards) == 1 or self.processes <= 1:
+            results = [_score_rows(self.scorer.data, shard) for shard in shards]
+        else:
+            results = self._get_pool().map(_score_shard, shards)
+
+        positions = np.concatenate([result[0] for result in results])
+        scores = np.concatenate([result[1] for result in results])
+
+        top = BayesianSets.top_indices(scores, count, opt_offset)
+        return [positions[top], scores[top]]
+
+    # Stops the processes of the pool.
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = Pool(self.processes, _init_worker,
+                              (self._data, self._indices, self._indptr, self.shape))
+        return self._pool
+
+# Copies an array into shared memory. Returns the shared buffer with the dtype
+# of the array.
+def _share(array):
+    array = np.ascontiguousarray(array)
+    shared = RawArray('b', max(array.nbytes, 1))
+    np.frombuffer(shared, dtype=np.int8)[:array.nbytes] = array.view(np.int8)
+    return (shared, array.dtype, len(array))
+
+def _view(shared):
+    [buf, dtype, length] = shared
+    return np.frombuffer(buf, dtype=dtype, count=length)
+
+# Data matrix of a worker process, mapped on the shared arrays.
+_data = None
+
+def _init_worker(data, indices, indptr, shape):
+    global _data
+    _data = csr_matrix((_view(data), _view(indices), _view(indptr)), shape=shape, copy=False)
+
+def _score_shard(shard):
+    return _score_rows(_data, shard)
+
+# Scores the data rows of a shard (rows, start, count, C, q), rows being
+# other_indices[start:start + len(rows)], and returns the positions in
+# other_indices and the scores of the count best ones.
+def _score_rows(X, shard):
+    [rows, start, count, C, q] = shard
+
+    score = np.add(C, np.asarray(X[rows, :].dot(q)).ravel())
+    top = BayesianSets.top_indices(score, count)
+    return [top + start, score[top]]
@@ -0,0 +1,32 @@
+import numpy as np
+
+# Sparse (or dense) matrix with labelled rows and columns, e.g. urls and terms
+# of a tf-idf matrix. Labels are looked up through hash maps rather than
+# lists, so that looking up labels costs in proportion to their number.
+class term_matrix:
+    def __init__(self, matrix, rows, columns, opt_row_index = None, opt_column_index = None):
+        self.matrix = matrix
+        self.rows = rows
+        self.columns = columns
+        self.row_index = opt_row_index if opt_row_index is not None else \
+                         {label: i for i, label in enumerate(rows)}
+        self.column_index = opt_column_index if opt_column_index is not None else \
+                            {label: i for i, label in enumerate(columns)}
+
+    # Returns the indices of the labels present in the matrix, in the order of
+    # labels.
+    def getRowIndices(self, labels):
+        return term_matrix.lookup(self.row_index, labels)
+
+    def getColumnIndices(self, labels):
+        return term_matrix.lookup(self.column_index, labels)
+
+    def getColumnMask(self, labels):
+        mask = np.zeros(len(self.columns), dtype=bool)
+        mask[self.getColumnIndices(labels)] = True
+        return mask
+
+    @staticmethod
+    def lookup(index, labels):
+        return np.array([index[label] for label in labels if label in index], dtype=np.int64)
+
@@ -0,0 +1,260 @@
+import os
+import shutil
+import unittest
+import numpy as np
+from tempfile import mkdtemp
+from scipy.sparse import csr_matrix
+
+import tfidf
+from elastic.get_mtermvectors import prune_vocabulary
+from near_duplicates import near_duplicates
+from matrix_store import matrix_store
+
+# Term frequencies of the documents of a fake index, by document.
+DOCUMENTS = {
+    'a': {'apple': 2, 'banana': 1},
+    'b': {'banana': 3, 'cherry': 1},
+    'c': {'cherry': 2, 'date': 1, 'apple': 1},
+    'd': {'elder': 4},
+    'e': {'apple': 1, 'fig': 2},
+    'f': {'grape': 1, 'banana': 1, 'fig': 1},
+}
+
+# Same results as elastic.get_mtermvectors.getTermStatistics over DOCUMENTS,
+# with an idf fixed per term so that they do not depend on the batch.
+def fake_term_statistics(all_hits, es_index = 'memex', es_doc_type = 'page', es = None):
+    docs = [doc for doc in all_hits if doc in DOCUMENTS]
+    corpus = sorted(set(term for doc in docs for term in DOCUMENTS[doc]))
+    columns = {term: i for i, term in enumerate(corpus)}
+
+    tf = np.zeros((len(docs), len(corpus)))
+    for i, doc in enumerate(docs):
+        for term, count in DOCUMENTS[doc].items():
+            tf[i, columns[term]] = count
+    idf = np.array([1.0 + len(term) % 3 for term in corpus])
+    ttf = dict.fromkeys(corpus, 0)
+    for frequencies in DOCUMENTS.values():
+        for term, count in frequencies.items():
+            if term in ttf:
+                ttf[term] += count
+
+    return [csr_matrix(tf * idf), csr_matrix(tf), ttf, corpus, docs]
+
+# Returns the non zero values of a model matrix, by (document, term).
+def cells(documents, corpus, matrix):
+    matrix = matrix.tocoo()
+    return {(documents[i], corpus[j]): value for i, j, value in zip(matrix.row, matrix.col, matrix.data)}
+
+# Runs tfidf over the fake index DOCUMENTS.
+class FakeStatisticsTestCase(unittest.TestCase):
+    def setUp(self):
+        self._getTermStatistics = tfidf.getTermStatistics
+        tfidf.getTermStatistics = fake_term_statistics
+
+    def tearDown(self):
+        tfidf.getTermStatistics = self._getTermStatistics
+
+    def assertSameModel(self, model, expected):
+        self.assertEqual(sorted(model.documents), sorted(expected.documents))
+        self.assertEqual(sorted(model.corpus), sorted(expected.corpus))
+        self.assertEqual(cells(*model.getTfidfArray()), cells(*expected.getTfidfArray()))
+        self.assertEqual(cells(*model.getTfArray()), cells(*expected.getTfArray()))
+        self.assertEqual(dict(zip(model.corpus, model.df.tolist())),
+                         dict(zip(expected.corpus, expected.df.tolist())))
+        self.assertEqual(model.getTtf(), expected.getTtf())
+        self.assertTrue(model.tfidfArray.has_sorted_indices)
+
+class TfidfUpdateTest(FakeStatisticsTestCase):
+    def test_add_documents(self):
+        model = tfidf.tfidf(['a', 'b'])
+        model.add_documents(['c', 'd', 'a'])
+        model.add_documents(['e', 'f', 'missing'])
+        self.assertSameModel(model, tfidf.tfidf(['a', 'b', 'c', 'd', 'e', 'f']))
+
+    def test_remove_documents(self):
+        model = tfidf.tfidf(['a', 'b', 'c', 'd', 'e', 'f'])
+        model.remove_documents(['b', 'd', 'missing'])
+        self.assertSameModel(model, tfidf.tfidf(['a', 'c', 'e', 'f']))
+        self.assertFalse('elder' in model.corpus)
+        self.assertFalse('elder' in model.getTtf())
+
+    def test_add_after_remove(self):
+        model = tfidf.tfidf(['a', 'b', 'c'])
+        model.remove_documents(['a', 'c'])
+        model.add_documents(['d', 'c'])
+        self.assertSameModel(model, tfidf.tfidf(['b', 'd', 'c']))
+        self.assertEqual(model.getIndex(['cherry', 'unknown']), [model.corpus.index('cherry')])
+
+class TfidfPruningTest(FakeStatisticsTestCase):
+    def test_min_df_and_max_df(self):
+        model = tfidf.tfidf(['a', 'b', 'c', 'd', 'e', 'f'], opt_min_df=2, opt_max_df=0.5)
+        self.assertEqual(sorted(model.corpus), ['apple', 'banana', 'cherry', 'fig'])
+        self.assertEqual(model.tfidfArray.shape, (6, 4))
+
+    def test_max_features(self):
+        model = tfidf.tfidf(['a', 'b', 'c', 'd', 'e', 'f'], opt_max_features=2)
+        # apple and elder tie, the first column is kept
+        self.assertEqual(sorted(model.corpus), ['apple', 'banana'])
+
+    def test_incremental_pruning_matches_rebuild(self):
+        options = [{'opt_min_df': 2}, {'opt_max_df': 0.4}, {'opt_max_features': 3}]
+        for opts in options:
+            model = tfidf.tfidf(['a', 'b'], **opts)
+            for docs in [['c'], ['d', 'e'], ['f']]:
+                model.add_documents(docs)
+                model.getTfidfArray()
+            model.remove_documents(['b'])
+            expected = tfidf.tfidf(['a', 'c', 'd', 'e', 'f'], **opts)
+            self.assertEqual(sorted(model.corpus), sorted(expected.corpus))
+            self.assertEqual(cells(*model.getTfidfArray()), cells(*expected.getTfidfArray()))
+            self.assertEqual(cells(*model.getTfArray()), cells(*expected.getTfArray()))
+
+    # Adds a larger corpus a few documents at a time, so that the pruned
+    # matrices are extended rather than rebuilt by most reads.
+    def test_incremental_pruning_of_a_large_corpus(self):
+        state = np.random.RandomState(0)
+        docs = ['doc%d' % i for i in range(1000)]
+        for doc in docs:
+            terms = state.zipf(1.5, 20)
+            DOCUMENTS[doc] = {'t%d' % term: int(count) for term, count in zip(*np.unique(terms, return_counts=True))}
+        try:
+            for opts in [{'opt_min_df': 3}, {'opt_max_df': 0.05}, {'opt_min_df': 2, 'opt_max_features': 300}]:
+                model = tfidf.tfidf(docs[:100], **opts)
+                extended = 0
+                for start in range(100, len(docs), 5):
+                    model.add_documents(docs[start:start+5])
+                    indptr = model._p_indptr
+                    model.getTfidfArray()
+                    if model._p_indptr is indptr:
+                        extended += 1
+                self.assertTrue(extended > 0)
+
+                expected = tfidf.tfidf(docs, **opts)
+                unpruned = tfidf.tfidf(docs)
+                self.assertEqual(cells(*model.getTfidfArray()),
+                                 {cell: value for cell, value in cells(*unpruned.getTfidfArray()).items()
+                                  if cell[1] in model._vocabulary})
+                if 'opt_max_features' in opts:
+                    # Terms tying for the last places are ordered differently
+                    # in expected, the most frequent terms are looked up in
+                    # the order of model.
+                    exact = prune_vocabulary(model._df, len(docs), 2, 1.0, 300, model._tf_sum)
+                    stale = set(model.corpus) - set(model._terms[i] for i in exact)
+                    self.assertEqual(len(model.corpus), 300)
+                    self.assertTrue(len(stale) <= 300 * model.PRUNE_TOLERANCE)
+                else:
+                    self.assertEqual(sorted(model.corpus), sorted(expected.corpus))
+                self.assertTrue(model.df.min() >= opts.get('opt_min_df', 1))
+                self.assertTrue(model.df.max() <= opts.get('opt_max_df', 1.0) * len(docs))
+        finally:
+            for doc in docs:
+                del DOCUMENTS[doc]
+
+    def test_returned_corpus_is_unchanged(self):
+        model = tfidf.tfidf(['a'])
+        corpus = model.corpus
+        model.add_documents(['d'])
+        self.assertEqual(corpus, ['apple', 'banana'])
+        self.assertTrue('elder' in model.corpus)
+
+class TfidfStoreTest(FakeStatisticsTestCase):
+    def setUp(self):
+        FakeStatisticsTestCase.setUp(self)
+        self.store = matrix_store(mkdtemp())
+        self.fetched = []
+        def recording_term_statistics(all_hits, *args):
+            self.fetched.append(list(all_hits))
+            return fake_term_statistics(all_hits, *args)
+        tfidf.getTermStatistics = recording_term_statistics
+
+    def tearDown(self):
+        FakeStatisticsTestCase.tearDown(self)
+        shutil.rmtree(self.store.store_dir)
+
+    def test_load(self):
+        tfidf.tfidf(['a', 'b', 'c', 'd'], opt_store=self.store).save()
+        model = tfidf.tfidf(opt_store=self.store)
+        self.assertTrue(model.load())
+        model.add_documents(['e'])
+        self.assertEqual(self.fetched, [['a', 'b', 'c', 'd'], ['e']])
+        self.assertSameModel(model, tfidf.tfidf(['a', 'b', 'c', 'd', 'e']))
+
+    def test_stored_documents_are_not_fetched(self):
+        tfidf.tfidf(['a', 'b', 'c', 'd'], opt_store=self.store).save()
+        del self.fetched[:]
+        model = tfidf.tfidf(['c', 'e', 'a'], opt_store=self.store, opt_min_df=2)
+        self.assertEqual(self.fetched, [['e']])
+
+        self.assertSameModel(model, tfidf.tfidf(['c', 'e', 'a'], opt_min_df=2))
+
+    def test_without_snapshot(self):
+        model = tfidf.tfidf(['a', 'b'], opt_store=self.store)
+        self.assertFalse(model.load())
+        self.assertEqual(self.fetched, [['a', 'b']])
+
+    def test_saves_leave_no_temporary_files(self):
+        model = tfidf.tfidf(['a', 'b'], opt_store=self.store)
+        names = [model.save(), model.save(), model.save()]
+        self.assertEqual(self.store.current('memex'), names[-1])
+        self.assertEqual(self.store.snapshots('memex'), names[-2:])
+        self.assertEqual(sorted(os.listdir(os.path.join(self.store.store_dir, 'memex'))), sorted(['CURRENT'] + names[-2:]))
+
+# Rows of a term matrix holding terms, over the columns of all terms.
+def term_rows(terms):
+    corpus = sorted(set(term for row in terms for term in row))
+    columns = {term: i for i, term in enumerate(corpus)}
+    matrix = np.zeros((len(terms), len(corpus)))
+    for i, row in enumerate(terms):
+        for term in row:
+            matrix[i, columns[term]] = 1
+    return [csr_matrix(matrix), corpus]
+
+class NearDuplicatesTest(FakeStatisticsTestCase):
+    def setUp(self):
+        FakeStatisticsTestCase.setUp(self)
+        page = ['term%d' % i for i in range(40)]
+        other = ['other%d' % i for i in range(40)]
+        [matrix, corpus] = term_rows([page, other, page[:39] + ['session'], page, other, []])
+        self.duplicates = near_duplicates()
+        self.duplicates.add(['p1', 'o1', 'p2', 'p3', 'o2', 'empty'], matrix, corpus)
+
+    def test_groups_near_duplicates(self):
+        self.assertEqual(self.duplicates.getRepresentatives(['p1', 'p2', 'p3', 'o1', 'o2', 'empty', 'new']),
+                         ['p1', 'p1', 'p1', 'o1', 'o1', 'empty', 'new'])
+        self.assertEqual(sorted(self.duplicates.getDuplicates(['p2'])), ['p1', 'p3'])
+        self.assertEqual(len(self.duplicates), 6)
+        self.assertTrue('p2' in self.duplicates)
+
+    def test_empty_documents_are_not_duplicates(self):
+        [matrix, corpus] = term_rows([[]])
+        self.duplicates.add(['empty2'], matrix, corpus)
+        self.assertEqual(self.duplicates.getRepresentatives(['empty2']), ['empty2'])
+
+    def test_collapse(self):
+        self.assertEqual(self.duplicates.collapse(['p2', 'o1', 'p1', 'o2', 'new', 'p3']), ['p2', 'o1', 'new'])
+        self.assertEqual(self.duplicates.collapse(['p2', 'o1', 'new'], ['p3']), ['o1', 'new'])
+
+    def test_remove_representative(self):
+        self.duplicates.remove(['p1'])
+        self.assertEqual(self.duplicates.getRepresentatives(['p2', 'p3']), ['p2', 'p2'])
+        self.assertFalse('p1' in self.duplicates)
+
+        [matrix, corpus] = term_rows([['term%d' % i for i in range(40)]])
+        self.duplicates.add(['p1'], matrix, corpus)
+        self.assertEqual(self.duplicates.getRepresentatives(['p1']), ['p2'])
+
+    def test_tfidf_leaves_duplicates_out(self):
+        DOCUMENTS['a2'] = dict(DOCUMENTS['a'])
+        try:
+            model = tfidf.tfidf(['a', 'b', 'a2'], opt_collapse_duplicates=True)
+            self.assertEqual(model.documents, ['a', 'b'])
+            self.assertEqual(model.getRepresentatives(['a2', 'b']), ['a', 'b'])
+
+            model.remove_documents(['a'])
+            model.add_documents(['a2'])
+            self.assertEqual(model.documents, ['b', 'a2'])
+        finally:
+            del DOCUMENTS['a2']
+
+if __name__ == '__main__':
+    unittest.main()
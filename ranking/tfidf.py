@@ -5,21 +5,49 @@ import operator
 import numpy as np
 from os.path import exists
 from collections import OrderedDict
-from elastic.get_mtermvectors import getTermStatistics
+from scipy.sparse import csr_matrix
+from elastic.get_mtermvectors import getTermStatistics, prune_vocabulary
+from term_matrix import term_matrix
+import BayesianSets
+from sharded_scorer import ShardedScorer
+from near_duplicates import near_duplicates
+from matrix_store import matrix_store
 
 class tfidf:
-    def __init__(self, opt_docs = None, es_index = 'memex', es_doc_type = 'page', es = None):
-        self.documents = opt_docs
-        self.corpus = None
-        self.tfidfArray = None
-        self.tfArray = None
-        self.ttf = None
+    # If opt_collapse_duplicates is True, near duplicates of documents already
+    # in the model are left out of the matrices (see near_duplicates), and
+    # stand for their representative.
+    #
+    # The corpus of the matrices is limited to the terms held by at least
+    # opt_min_df documents and at most a ratio opt_max_df of them, and among
+    # those to the opt_max_features most frequent ones (if not None). Terms are
+    # pruned from the documents of the whole model, as documents are added or
+    # removed.
+    #
+    # If opt_store (a matrix_store) is given, the term statistics of documents
+    # in the current snapshot of the index are read from it rather than
+    # fetched from the index (see _fetch), and save and load use it by
+    # default.
+    def __init__(self, opt_docs = None, es_index = 'memex', es_doc_type = 'page', es = None, opt_collapse_duplicates = False,
+                 opt_min_df = 1, opt_max_df = 1.0, opt_max_features = None, opt_store = None):
+        self.es_index = es_index
+        self.es_doc_type = es_doc_type
+        self.es = es
+        self.collapse_duplicates = opt_collapse_duplicates
+        self.min_df = opt_min_df
+        self.max_df = opt_max_df
+        self.max_features = opt_max_features
+        self.store = opt_store
+        # [es_index, name, tfidf, tf, ttf, corpus, doc_index] of the snapshot
+        # last read by _fetch.
+        self._snapshot = None
+        self.reset()
         if opt_docs != None:
           self.process(opt_docs, es_index, es_doc_type, es)
 
     def getTopTerms(self,top):
         N = len(self.documents)
-        avg = np.divide(np.sum(self.tfidfArray.toarray(), axis=0), N)
+        avg = np.divide(np.asarray(self.tfidfArray.sum(axis=0)).ravel(), N)
         sortedAvgIndices = np.argsort(avg)[::-1]
         return [self.corpus[i] for i in sortedAvgIndices[0:top]]
 
@@ -27,8 +55,8 @@ class tfidf:
 
         index = []
         for term in terms:
-            if term.strip() in self.corpus:
-                index.append(self.corpus.index(term.strip()))
+            if term.strip() in self._vocabulary:
+                index.append(self._vocabulary[term.strip()])
         return index
 
     def getTfidfArray(self):
@@ -37,6 +65,43 @@ class tfidf:
     def getTfArray(self):
         return [self.documents, self.corpus, self.tfArray]
 
+    # Returns the tf-idf matrix with its documents and corpus as a term_matrix.
+    def getTfidfMatrix(self):
+        return term_matrix(self.tfidfArray, self.documents, self.corpus, self._doc_index, self._vocabulary)
+
+    def getTfMatrix(self):
+        return term_matrix(self.tfArray, self.documents, self.corpus, self._doc_index, self._vocabulary)
+
+    # Returns the Bayesian Sets scorer over the column normalised tf-idf
+    # matrix, or over its transpose (terms as rows) if transposed is True.
+    # Scorers are computed once per state of the model.
+    def getScorer(self, transposed = False):
+        scorer = self._scorers.get(transposed)
+        if scorer is None:
+            data = BayesianSets.normalize_columns(self.tfidfArray)
+            if transposed:
+                data = data.transpose().tocsr()
+            scorer = BayesianSets.BayesianSetsScorer(data)
+            self._scorers[transposed] = scorer
+        return scorer
+
+    # Returns a scorer running on a pool of processes over the data of
+    # getScorer(transposed), kept in shared memory while the model is unchanged.
+    def getShardedScorer(self, transposed = False, opt_processes = None):
+        key = ('sharded', transposed, opt_processes)
+        scorer = self._scorers.get(key)
+        if scorer is None:
+            scorer = ShardedScorer(self.getScorer(transposed), opt_processes)
+            self._scorers[key] = scorer
+        return scorer
+
+    # Returns the documents of the model standing for each of documents: the
+    # representative of the near duplicates left out, the document otherwise.
+    def getRepresentatives(self, documents):
+        if self.duplicates is None:
+            return list(documents)
+        return self.duplicates.getRepresentatives(documents)
+
     def getTtf(self):
         return self.ttf
 
@@ -47,8 +112,410 @@ class tfidf:
         return [self.corpus[x] for x in indices]
 
     def process(self, documents, es_index = 'memex', es_doc_type = 'page', es = None):
-        [data_tfidf, data_tf, data_ttf, corpus] = getTermStatistics(documents, es_index, es_doc_type, es)
-        self.tfidfArray = data_tfidf
-        self.tfArray = data_tf
-        self.ttf = data_ttf
-        self.corpus = corpus
+        self.es_index = es_index
+        self.es_doc_type = es_doc_type
+        self.es = es
+        self.reset()
+        self.add_documents(documents)
+
+    def reset(self):
+        # Documents (rows) of the matrices. Documents without term vectors are
+        # left out.
+        self.documents = []
+        self._doc_index = {}
+        # All terms of the documents, and the number of documents holding
+        # each. New terms are appended, so adding documents never moves
+        # existing columns of the arrays below.
+        self._terms = []
+        self._term_index = {}
+        self._df = np.zeros(0, dtype=np.int32)
+        # Sum of the term frequencies of each term, for opt_max_features.
+        self._tf_sum = np.zeros(0, dtype=np.float64)
+        self.ttf = {}
+        # Near duplicates index of the documents, including those left out.
+        self.duplicates = near_duplicates() if self.collapse_duplicates else None
+
+        # The matrices are views over these arrays, which grow by doubling
+        # their capacity so that adding documents costs in proportion to their
+        # terms only.
+        self._indptr = np.zeros(1, dtype=np.int32)
+        self._indices = np.zeros(0, dtype=np.int32)
+        self._tfidf_data = np.zeros(0, dtype=np.float64)
+        self._tf_data = np.zeros(0, dtype=np.float64)
+        self._nnz = 0
+
+        # Pruned matrices (see _build_matrices): the kept columns, the number
+        # of terms and documents of the model when they were last read, and
+        # their arrays.
+        self._kept = None
+        self._kept_terms = 0
+        self._kept_rows = 0
+        self._p_indptr = np.zeros(1, dtype=np.int32)
+        self._p_indices = np.zeros(0, dtype=np.int32)
+        self._p_tfidf_data = np.zeros(0, dtype=np.float64)
+        self._p_tf_data = np.zeros(0, dtype=np.float64)
+        self._p_nnz = 0
+        if not hasattr(self, '_scorers'):
+            self._scorers = {}
+        self._update_matrices()
+
+    # Saves the model as the current snapshot of its index in store (the store
+    # of the model, or the default matrix_store, if None). Returns the name of
+    # the snapshot.
+    def save(self, opt_store = None):
+        store = self._get_store(opt_store)
+        n_docs = len(self.documents)
+        arrays = {
+            'indptr': self._indptr[:n_docs+1],
+            'indices': self._indices[:self._nnz],
+            'tfidf': self._tfidf_data[:self._nnz],
+            'tf': self._tf_data[:self._nnz],
+            'df': self._df,
+            'ttf': np.array([self.ttf[term] for term in self._terms], dtype=np.float64)
+        }
+        return store.save(self.es_index, arrays, self.documents, self._terms)
+
+    # Replaces the model with the current snapshot of its index in store (as
+    # save), instead of fetching the term statistics of its documents. The
+    # matrices are views over the memory mapped files of the snapshot, they
+    # are copied only when documents are added or removed. Returns False if
+    # the index has no snapshot.
+    def load(self, opt_store = None):
+        store = self._get_store(opt_store)
+        snapshot = store.load(self.es_index)
+        if snapshot is None:
+            return False
+
+        [arrays, documents, corpus] = snapshot
+        self.reset()
+        self.documents = documents
+        self._doc_index = {doc: i for i, doc in enumerate(documents)}
+        self._terms = corpus
+        self._term_index = {term: i for i, term in enumerate(corpus)}
+        self._df = arrays['df']
+        self.ttf = dict(zip(corpus, arrays['ttf'].tolist()))
+
+        self._indptr = arrays['indptr']
+        self._indices = arrays['indices']
+        self._tfidf_data = arrays['tfidf']
+        self._tf_data = arrays['tf']
+        self._nnz = len(self._indices)
+        self._tf_sum = np.bincount(self._indices, weights=self._tf_data, minlength=len(corpus))
+        self._update_matrices()
+
+        if self.duplicates is not None:
+            tf = csr_matrix((self._tf_data, self._indices, self._indptr), shape=(len(documents), len(corpus)))
+            self.duplicates.add(self.documents, tf, self._terms)
+
+        return True
+
+    def _get_store(self, opt_store = None):
+        if opt_store is not None:
+            return opt_store
+        return self.store if self.store is not None else matrix_store()
+
+    # Returns the term statistics of documents, as a list of results of
+    # getTermStatistics. Those of the documents in the current snapshot of the
+    # index in the store of the model are read from the snapshot, the others
+    # are fetched from the index.
+    def _fetch(self, documents):
+        snapshot = self._get_snapshot()
+        if snapshot is None:
+            return [getTermStatistics(documents, self.es_index, self.es_doc_type, self.es)]
+
+        [tfidf_matrix, tf_matrix, ttf, corpus, doc_index] = snapshot
+        stored = [doc for doc in documents if doc in doc_index]
+        missing = [doc for doc in documents if doc not in doc_index]
+
+        statistics = []
+        if len(stored) > 0:
+            rows = np.array([doc_index[doc] for doc in stored], dtype=np.int64)
+            data_tf = tf_matrix[rows]
+            columns = np.unique(data_tf.indices)
+            terms = [corpus[i] for i in columns]
+            statistics.append([tfidf_matrix[rows][:, columns], data_tf[:, columns],
+                               dict(zip(terms, ttf[columns].tolist())), terms, stored])
+        if len(missing) > 0:
+            statistics.append(getTermStatistics(missing, self.es_index, self.es_doc_type, self.es))
+        return statistics
+
+    # Returns [tfidf, tf, ttf, corpus, doc_index] of the current snapshot of
+    # the index in the store of the model, or None. The snapshot is read again
+    # only once another one becomes current.
+    def _get_snapshot(self):
+        if self.store is None:
+            return None
+        name = self.store.current(self.es_index)
+        if name is None:
+            return None
+
+        if self._snapshot is None or self._snapshot[:2] != [self.es_index, name]:
+            loaded = self.store.load(self.es_index)
+            if loaded is None:
+                return None
+            [arrays, documents, corpus] = loaded
+            shape = (len(documents), len(corpus))
+            self._snapshot = [self.es_index, name,
+                              csr_matrix((arrays['tfidf'], arrays['indices'], arrays['indptr']), shape=shape, copy=False),
+                              csr_matrix((arrays['tf'], arrays['indices'], arrays['indptr']), shape=shape, copy=False),
+                              arrays['ttf'], corpus, {doc: i for i, doc in enumerate(documents)}]
+        return self._snapshot[2:]
+
+    # Adds the documents not in the model yet, fetching their term statistics
+    # (see _fetch).
+    def add_documents(self, documents):
+        new_docs = [doc for doc in OrderedDict.fromkeys(documents)
+                    if doc not in self._doc_index and (self.duplicates is None or doc not in self.duplicates)]
+        if len(new_docs) == 0:
+            return
+
+        for statistics in self._fetch(new_docs):
+            self._add_statistics(statistics)
+
+    # Adds documents with their term statistics, as returned by
+    # getTermStatistics.
+    def _add_statistics(self, statistics):
+        [data_tfidf, data_tf, data_ttf, corpus, docs] = statistics
+        if len(docs) == 0:
+            return
+
+        if self.duplicates is not None:
+            self.duplicates.add(docs, data_tf, corpus)
+            keep = [i for i, rep in enumerate(self.duplicates.getRepresentatives(docs)) if rep == docs[i]]
+            if len(keep) < len(docs):
+                columns = np.unique(data_tf[keep].indices)
+                data_tfidf = data_tfidf[keep][:, columns]
+                data_tf = data_tf[keep][:, columns]
+                corpus = [corpus[i] for i in columns]
+                docs = [docs[i] for i in keep]
+                data_ttf = {term: data_ttf[term] for term in corpus}
+                if len(docs) == 0:
+                    return
+
+        # Maps the columns of the new documents to the model vocabulary.
+        columns = np.empty(len(corpus), dtype=np.int32)
+        for i, term in enumerate(corpus):
+            column = self._term_index.get(term)
+            if column is None:
+                column = len(self._terms)
+                self._term_index[term] = column
+                self._terms.append(term)
+            columns[i] = column
+
+        indices = columns[data_tfidf.indices]
+        tfidf_data = data_tfidf.data
+        tf_data = data_tf.data
+
+        # Keeps the indices of each row sorted.
+        rows = np.repeat(np.arange(len(docs)), np.diff(data_tfidf.indptr))
+        order = np.lexsort((indices, rows))
+        indices = indices[order]
+
+        n_docs = len(self.documents)
+        nnz = self._nnz + len(indices)
+        self._indptr = self._reserve(self._indptr, n_docs + len(docs) + 1)
+        self._indices = self._reserve(self._indices, nnz)
+        self._tfidf_data = self._reserve(self._tfidf_data, nnz)
+        self._tf_data = self._reserve(self._tf_data, nnz)
+
+        self._indptr[n_docs+1:n_docs+len(docs)+1] = data_tfidf.indptr[1:] + self._nnz
+        self._indices[self._nnz:nnz] = indices
+        self._tfidf_data[self._nnz:nnz] = tfidf_data[order]
+        self._tf_data[self._nnz:nnz] = tf_data[order]
+        self._nnz = nnz
+
+        for doc in docs:
+            self._doc_index[doc] = len(self.documents)
+            self.documents.append(doc)
+
+        df = np.zeros(len(self._terms), dtype=np.int32)
+        df[:len(self._df)] = self._df
+        df += np.bincount(indices, minlength=len(self._terms)).astype(np.int32)
+        self._df = df
+
+        tf_sum = np.zeros(len(self._terms), dtype=np.float64)
+        tf_sum[:len(self._tf_sum)] = self._tf_sum
+        tf_sum += np.bincount(indices, weights=tf_data[order], minlength=len(self._terms))
+        self._tf_sum = tf_sum
+
+        self.ttf.update(data_ttf)
+
+        self._update_matrices()
+
+    # Removes documents from the model. Terms no longer held by any document
+    # are removed from the corpus.
+    def remove_documents(self, documents):
+        if self.duplicates is not None:
+            # Duplicates left out in favour of removed documents are forgotten
+            # too, so that adding them again brings them back.
+            removed = [doc for doc in set(documents) if doc in self._doc_index]
+            self.duplicates.remove(removed + self.duplicates.getDuplicates(removed))
+
+        rows = [self._doc_index[doc] for doc in set(documents) if doc in self._doc_index]
+        if len(rows) == 0:
+            return
+
+        n_docs = len(self.documents)
+        keep_rows = np.ones(n_docs, dtype=bool)
+        keep_rows[rows] = False
+
+        indptr = self._indptr[:n_docs+1]
+        indices = self._indices[:self._nnz]
+        row_lengths = np.diff(indptr)
+        keep = np.repeat(keep_rows, row_lengths)
+
+        self._df = self._df - np.bincount(indices[~keep], minlength=len(self._terms)).astype(np.int32)
+        self._tf_sum = self._tf_sum - np.bincount(indices[~keep], weights=self._tf_data[:self._nnz][~keep],
+                                                  minlength=len(self._terms))
+
+        # Compacts the columns of the terms left.
+        keep_columns = self._df > 0
+        columns = np.cumsum(keep_columns, dtype=np.int32) - 1
+
+        self._indices = columns[indices[keep]]
+        self._tfidf_data = self._tfidf_data[:self._nnz][keep]
+        self._tf_data = self._tf_data[:self._nnz][keep]
+        self._nnz = len(self._indices)
+        self._indptr = np.concatenate(([0], np.cumsum(row_lengths[keep_rows]))).astype(np.int32)
+
+        for i in np.where(~keep_columns)[0]:
+            self.ttf.pop(self._terms[i], None)
+        self._terms = [self._terms[i] for i in np.where(keep_columns)[0]]
+        self._term_index = {term: i for i, term in enumerate(self._terms)}
+        self._df = self._df[keep_columns]
+        self._tf_sum = self._tf_sum[keep_columns]
+        # Columns moved, the pruned matrices are rebuilt.
+        self._kept = None
+
+        self.documents = [self.documents[i] for i in np.where(keep_rows)[0]]
+        self._doc_index = {doc: i for i, doc in enumerate(self.documents)}
+
+        self._update_matrices()
+
+    # Matrices of the model over the terms kept by prune_vocabulary, their
+    # corpus, vocabulary and the number of documents holding each term. They
+    # are computed when first read after the model changed, and callers must
+    # not modify them in place.
+    tfidfArray = property(lambda self: self._get_matrices()[0])
+    tfArray = property(lambda self: self._get_matrices()[1])
+    corpus = property(lambda self: self._get_matrices()[2])
+    _vocabulary = property(lambda self: self._get_matrices()[3])
+    df = property(lambda self: self._get_matrices()[4])
+
+    # Ratio of the kept terms which may differ from the opt_max_features most
+    # frequent ones, before the pruned matrices are rebuilt.
+    PRUNE_TOLERANCE = 0.01
+
+    # Drops the matrices and scorers of the previous state of the model.
+    def _update_matrices(self):
+        for scorer in self._scorers.values():
+            if isinstance(scorer, ShardedScorer):
+                scorer.close()
+        self._scorers = {}
+        self._matrices = None
+
+    def _get_matrices(self):
+        if self._matrices is None:
+            self._matrices = self._build_matrices()
+        return self._matrices
+
+    # Returns [tfidfArray, tfArray, corpus, vocabulary, df]. When no term is
+    # pruned, the matrices are views over the arrays of the model. Otherwise
+    # the pruned matrices are kept in their own arrays, and only the documents
+    # added since they were last read are appended to them (new terms being
+    # kept as long as they fit in opt_max_features). opt_min_df and opt_max_df
+    # are always applied exactly: the pruned matrices are rebuilt from the
+    # whole model when a kept term crosses them, or an earlier term is to be
+    # kept. Only the ranking of opt_max_features is approximate: they are
+    # rebuilt when more than PRUNE_TOLERANCE of the kept terms are not among
+    # the most frequent terms anymore.
+    def _build_matrices(self):
+        n_docs = len(self.documents)
+        n_terms = len(self._terms)
+        indptr = self._indptr[:n_docs+1]
+        indices = self._indices[:self._nnz]
+
+        eligible = prune_vocabulary(self._df, n_docs, self.min_df, self.max_df)
+        ranked = self.max_features is not None and len(eligible) > self.max_features
+        columns = eligible
+        if ranked:
+            columns = prune_vocabulary(self._df, n_docs, self.min_df, self.max_df, self.max_features, self._tf_sum)
+
+        if len(columns) == n_terms:
+            self._kept = None
+            shape = (n_docs, n_terms)
+            return [csr_matrix((self._tfidf_data[:self._nnz], indices, indptr), shape=shape, copy=False),
+                    csr_matrix((self._tf_data[:self._nnz], indices, indptr), shape=shape, copy=False),
+                    list(self._terms), dict(self._term_index), self._df.copy()]
+
+        first = 0
+        if self._kept is not None:
+            allowed = np.zeros(n_terms, dtype=bool)
+            allowed[eligible] = True
+            # The kept terms, extended with the terms added since the pruned
+            # matrices were built which should be kept and fit in
+            # opt_max_features.
+            new_columns = columns[columns >= self._kept_terms]
+            if ranked:
+                room = max(0, self.max_features - len(self._kept))
+                if len(new_columns) > room:
+                    top = np.lexsort((new_columns, -self._tf_sum[new_columns]))[:room]
+                    new_columns = np.sort(new_columns[top])
+            extended = np.concatenate((self._kept, new_columns))
+
+            if ranked:
+                stale = len(np.setdiff1d(extended, columns, assume_unique=True))
+                reuse = stale <= self.PRUNE_TOLERANCE * len(columns)
+            else:
+                reuse = np.array_equal(extended, columns)
+            if allowed[self._kept].all() and reuse:
+                columns = extended
+                first = self._kept_rows
+
+        if first == 0:
+            self._p_indptr = np.zeros(1, dtype=np.int32)
+            self._p_nnz = 0
+
+        column_map = np.empty(n_terms, dtype=np.int32)
+        column_map.fill(-1)
+        column_map[columns] = np.arange(len(columns), dtype=np.int32)
+
+        # Appends the rows from first, restricted to the kept columns.
+        start = indptr[first]
+        mapped = column_map[indices[start:]]
+        keep = mapped >= 0
+        rows = np.repeat(np.arange(n_docs - first), np.diff(indptr[first:]))
+        row_lengths = np.bincount(rows[keep], minlength=n_docs - first)
+
+        nnz = self._p_nnz + int(keep.sum())
+        self._p_indptr = self._reserve(self._p_indptr, n_docs + 1)
+        self._p_indices = self._reserve(self._p_indices, nnz)
+        self._p_tfidf_data = self._reserve(self._p_tfidf_data, nnz)
+        self._p_tf_data = self._reserve(self._p_tf_data, nnz)
+
+        self._p_indptr[first+1:n_docs+1] = self._p_nnz + np.cumsum(row_lengths)
+        self._p_indices[self._p_nnz:nnz] = mapped[keep]
+        self._p_tfidf_data[self._p_nnz:nnz] = self._tfidf_data[start:self._nnz][keep]
+        self._p_tf_data[self._p_nnz:nnz] = self._tf_data[start:self._nnz][keep]
+        self._p_nnz = nnz
+
+        self._kept = columns
+        self._kept_terms = n_terms
+        self._kept_rows = n_docs
+
+        shape = (n_docs, len(columns))
+        p_indptr = self._p_indptr[:n_docs+1]
+        p_indices = self._p_indices[:nnz]
+        corpus = [self._terms[i] for i in columns]
+        return [csr_matrix((self._p_tfidf_data[:nnz], p_indices, p_indptr), shape=shape, copy=False),
+                csr_matrix((self._p_tf_data[:nnz], p_indices, p_indptr), shape=shape, copy=False),
+                corpus, {term: i for i, term in enumerate(corpus)}, self._df[columns]]
+
+    @staticmethod
+    def _reserve(buf, size):
+        # Read only buffers (memory mapped snapshots) are copied
+        if size <= len(buf) and buf.flags.writeable:
+            return buf
+        grown = np.zeros(max(size, 2 * len(buf)), dtype=buf.dtype)
+        grown[:len(buf)] = buf
+        return grown
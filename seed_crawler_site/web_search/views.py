@@ -196,13 +196,13 @@ def get_query(request):
             
             results = get_downloaded_urls(environ['DDT_HOME']+'/seed_crawler/seeds_generator/results.txt')
             scm = seed_crawler_model.SeedCrawlerModel(results)
-            [ranked_urls, scores] = scm.submit_selected_urls(url_yes_choices, url_no_choices)
+            [ranked_urls, scores] = scm.submit_selected_urls(url_yes_choices, url_no_choices, 15)
             for i in range(0,len(ranked_urls)):
               print ranked_urls[i], " ", scores[i]
             #form_class = populate_score(ranked_urls[0:15], scores[0:15])
             #form3 = form_class()
             #return render(request, 'query_with_ranks.html', {'form1': form1,'form2':form2, 'form3':form3})
-            form_class = populate_urls(request, ranked_urls[0:15])
+            form_class = populate_urls(request, ranked_urls)
             form2 = form_class()
             return render(request, 'query_with_results.html', {'form1': form1,'form2':form2})
 
@@ -244,8 +244,8 @@ def get_query(request):
                 results = get_downloaded_urls(environ['DDT_HOME']+'/seed_crawler/seeds_generator/results.txt')
                 scm = seed_crawler_model.SeedCrawlerModel(results)
                 scm.submit_selected_urls(url_yes_choices, url_no_choices)
-                ranked_terms = scm.submit_selected_terms(int_yes_choices, int_no_choices)
-                form_class = populate_ranked_terms(request, ranked_terms[0:20])
+                ranked_terms = scm.submit_selected_terms(int_yes_choices, int_no_choices, 20)
+                form_class = populate_ranked_terms(request, ranked_terms)
                 form5 = form_class()
 
                 with open('selected_terms.txt','w+') as f:
@@ -277,8 +277,8 @@ def get_query(request):
                 results = get_downloaded_urls(environ['DDT_HOME']+'/seed_crawler/seeds_generator/results.txt')
                 scm = seed_crawler_model.SeedCrawlerModel(results)
                 scm.submit_selected_urls(url_yes_choices, url_no_choices)
-                ranked_terms = scm.submit_selected_terms(int_yes_choices, int_no_choices)
-                form_class = populate_ranked_terms(request, ranked_terms[0:20])
+                ranked_terms = scm.submit_selected_terms(int_yes_choices, int_no_choices, 20)
+                form_class = populate_ranked_terms(request, ranked_terms)
                 form5 = form_class(request.POST)                
 
                 return render(request, 'query_with_term_rank.html', {'form1': form1,'form2':form2, 'form4':form4, 'form5':form5})
@@ -98,8 +98,10 @@ class CrawlerModelAdapter:
   #             [url3, x, y, tags],
   #   ]
   # }
-  def getPages(self):
-    return self._crawlerModel.getPages()
+  # If opt_lastUpdate, opt_lastTagEdit and opt_lastPosition are given, returns only the changes
+  # since a previous response (see CrawlerModel.getPages).
+  def getPages(self, opt_lastUpdate = None, opt_lastTagEdit = None, opt_lastPosition = None):
+    return self._crawlerModel.getPages(opt_lastUpdate, opt_lastTagEdit, opt_lastPosition)
 
 
 
@@ -165,6 +167,7 @@ class SeedCrawlerModelAdapter(CrawlerModelAdapter):
   #   'Neutral': numNeutralPages,
   # }
   def getPagesSummary(self, opt_ts1 = None, opt_ts2 = None, opt_applyFilter = False):
+    opt_applyFilter = CrawlerModelAdapter.extractBooleanParam(opt_applyFilter)
     return self._crawlerModel.getPagesSummarySeedCrawler(opt_ts1, opt_ts2, opt_applyFilter)
 
 
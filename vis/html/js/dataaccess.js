@@ -31,13 +31,70 @@ var DataAccess = (function() {
     __sig__.emit(__sig__.new_pages_summary_fetched, summary, isFilter);
   };
 
-  // Processes loaded pages.
+  // Processes loaded pages: either all pages, or the pages, tags and positions changed since last
+  // update, which are merged into the current pages. Changes to pages discarded since they were
+  // requested (e.g. pages of the previous crawler) are dropped.
   var onPagesLoaded = function(loadedPages) {
-    pages = loadedPages;
-    lastUpdate = loadedPages['last_downloaded_url_epoch'];
+    if (loadedPages['delta']) {
+      if (pages === undefined || pages['pages'] === undefined) {
+        loadingPages = false;
+        return;
+      }
+      mergePages(loadedPages);
+    } else {
+      pages = loadedPages;
+    }
+    if (loadedPages['last_downloaded_url_epoch'] !== undefined) {
+      lastUpdate = loadedPages['last_downloaded_url_epoch'];
+    }
     loadingPages = false;
   };
 
+  // Merges new pages, tag edits and positions into the current pages. New pages are the most recent ones,
+  // and go first, and pages beyond the cap of the server are dropped.
+  var mergePages = function(delta) {
+    var index = {};
+    pages['pages'].forEach(function(page, i) {
+      index[page[0]] = i;
+    });
+
+    var newPages = [];
+    delta['pages'].forEach(function(page) {
+      if (page[0] in index) {
+        pages['pages'][index[page[0]]] = page;
+      } else {
+        newPages.push(page);
+      }
+    });
+    pages['pages'] = newPages.concat(pages['pages']).slice(0, delta['pages_cap']);
+
+    index = {};
+    pages['pages'].forEach(function(page, i) {
+      index[page[0]] = i;
+    });
+    delta['tags'].forEach(function(entry) {
+      if (entry[0] in index) {
+        pages['pages'][index[entry[0]]][3] = entry[1];
+      }
+    });
+    delta['positions'].forEach(function(entry) {
+      if (entry[0] in index) {
+        pages['pages'][index[entry[0]]][1] = entry[1];
+        pages['pages'][index[entry[0]]][2] = entry[2];
+      }
+    });
+
+    pages['last_downloaded_url_epoch'] = delta['last_downloaded_url_epoch'];
+    pages['last_tag_edit'] = delta['last_tag_edit'];
+    pages['last_position'] = delta['last_position'];
+    pages['pages_cap'] = delta['pages_cap'];
+  };
+
+  // Discards current pages, so that all pages are loaded on next update.
+  var resetPages = function() {
+    pages = undefined;
+  };
+
   // Processes loaded terms summaries.
   var onTermsSummaryLoaded = function(summary) {
     termsSummary = summary;
@@ -48,7 +105,9 @@ var DataAccess = (function() {
   var onMaybeUpdateComplete = function() {
     updating = loadingPages || loadingTerms;
     if (!updating) {
-      __sig__.emit(__sig__.pages_loaded, pages);
+      if (pages !== undefined) {
+        __sig__.emit(__sig__.pages_loaded, pages);
+      }
       __sig__.emit(__sig__.terms_summary_fetched, termsSummary);
     }
   };
@@ -116,6 +175,7 @@ var DataAccess = (function() {
   // Sets current crawler Id.
   pub.setActiveCrawler = function(crawlerId) {
     currentCrawler = crawlerId;
+    resetPages();
     runQuery('/setActiveCrawler', {'crawlerId': crawlerId});
   };
   // Queries the web for terms (used in Seed Crawler mode).
@@ -124,6 +184,7 @@ var DataAccess = (function() {
   };
   // Applies filter to returned pages and pages result.
   pub.applyFilter = function(terms) {
+    resetPages();
     runQueryForCurrentCrawler('/applyFilter', {'terms': terms});
   };
   // Loads pages (complete data, including URL, x and y position etc) and terms.
@@ -131,10 +192,20 @@ var DataAccess = (function() {
     if (!updating && currentCrawler !== undefined) {
       updating = true;
 
-      // Fetches pages summaries every n seconds.
+      // Fetches pages summaries every n seconds. Once pages are loaded, only changes since
+      // last update are fetched.
       loadingPages = true;
+      var args = {};
+      if (pages !== undefined && pages['last_tag_edit'] !== undefined &&
+          pages['last_position'] !== undefined && pages['last_position'] !== null) {
+        args = {
+          'opt_lastUpdate': lastUpdate,
+          'opt_lastTagEdit': pages['last_tag_edit'],
+          'opt_lastPosition': pages['last_position']
+        };
+      }
       runQueryForCurrentCrawler(
-        '/getPages', {}, onPagesLoaded, onMaybeUpdateComplete);
+        '/getPages', args, onPagesLoaded, onMaybeUpdateComplete);
 
       // Fetches terms summaries.
       loadingTerms = true;
@@ -177,6 +248,7 @@ var DataAccess = (function() {
   };
   // Sets limit of number of pages loaded.
   pub.setPagesCountCap = function(cap) {
+    resetPages();
     runQueryForCurrentCrawler(
       '/setPagesCountCap', {'pagesCap': cap});
   };
@@ -147,9 +147,11 @@ class Page:
   #             [url3, x, y, tags],
   #   ]
   # }
+  # If opt_lastUpdate, opt_lastTagEdit and opt_lastPosition are given, returns only the changes
+  # since a previous response (see CrawlerModel.getPages).
   @cherrypy.expose
-  def getPages(self):
-    res = self._crawler.getPages()
+  def getPages(self, opt_lastUpdate = None, opt_lastTagEdit = None, opt_lastPosition = None):
+    res = self._crawler.getPages(opt_lastUpdate, opt_lastTagEdit, opt_lastPosition)
     cherrypy.response.headers["Content-Type"] = "application/json;"
     return json.dumps(res)
 